@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+
+# Memory and time to parse a large synthetic note into paragraphs.
+# Run it on two revisions to compare them:
+#   python3 benchmarks/ast_memory.py
+
+import sys, os.path, random, time, tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lemma.services.xml_parser import XMLParser
+
+
+def make_xml(min_chars, seed):
+    rnd = random.Random(seed)
+    paragraphs = []
+    char_count = 0
+    while char_count < min_chars:
+        words = []
+        for i in range(60):
+            word = ''.join(rnd.choice('abcdefghij') for i in range(rnd.randint(2, 9)))
+            r = rnd.random()
+            if r < 0.1: word = '<strong>' + word + '</strong>'
+            elif r < 0.15: word = '<em>' + word + '</em>'
+            elif r < 0.17: word = '<a href="x">' + word + '</a>'
+            words.append(word)
+            char_count += len(word) + 1
+        paragraphs.append('<p indentation_level="0">' + ' '.join(words) + '\n</p>')
+    return '<head><title>benchmark</title></head><root>' + ''.join(paragraphs) + '</root>'
+
+
+xml = make_xml(200000, seed=0)
+
+tracemalloc.start()
+start = time.perf_counter()
+title, meta, paragraphs = XMLParser.parse(xml)
+parse_time = time.perf_counter() - start
+retained, peak = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+
+print('{0} characters in {1} paragraphs'.format(sum(len(paragraph) for paragraph in paragraphs), len(paragraphs)))
+print('retained memory: {0:.1f} MB (peak {1:.1f} MB)'.format(retained / 2**20, peak / 2**20))
+print('parse time: {0:.2f} s'.format(parse_time))
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+
+
+# Compares Layout.get_line_breaks with the greedy loop layout_paragraph used
+# before, on the boxes in line_breaks_corpus.json. The corpus holds short
+# random sequences (zero width and oversized boxes, eol and end anywhere), a
+# few long paragraphs, and the same with widths that aren't integers. Run it
+# with:
+#   python3 benchmarks/line_breaks.py
+# and with --generate to write the corpus again. The expected breaks are then
+# taken from layout_paragraph in the revision before get_line_breaks, so this
+# needs git and the repository history.
+
+import sys, os.path, random, time, json, subprocess, types
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lemma.document.document import Document
+from lemma.document.layout import Box
+from lemma.document.ast import Node
+
+
+corpus_filename = os.path.join(os.path.dirname(__file__), 'line_breaks_corpus.json')
+
+
+# the layout module of the revision before get_line_breaks was added.
+def get_baseline_layout_module():
+    repo_folder = os.path.join(os.path.dirname(__file__), '..')
+    revisions = subprocess.check_output(['git', 'log', '--reverse', '--format=%H', '-S', 'def get_line_breaks', '--', 'lemma/document/layout.py'], cwd=repo_folder, text=True).split()
+    source = subprocess.check_output(['git', 'show', revisions[0] + '^:lemma/document/layout.py'], cwd=repo_folder, text=True)
+
+    module = types.ModuleType('baseline_layout')
+    exec(compile(source, 'baseline_layout.py', 'exec'), module.__dict__)
+    return module
+
+
+# runs layout_paragraph of the baseline on fixed boxes, returning the index of
+# the first box of each line after the first. Only the line breaking is of
+# interest, so the lines aren't laid out.
+def get_baseline_line_breaks(module, case):
+    layout = module.Layout.__new__(module.Layout)
+    layout.layout_hbox = lambda line: None
+
+    paragraph = module.Box('paragraph', False, None, None)
+    paragraph.children = get_boxes(case, module.Box)
+    layout.layout_paragraph(paragraph, case['layout_width'], 0)
+
+    breaks = list()
+    line_start = 0
+    for line in paragraph.children[:-1]:
+        line_start += len(line.children)
+        breaks.append(line_start)
+    return breaks
+
+
+def get_boxes(case, box_class=Box):
+    boxes = list()
+    for box_type, value, width in case['boxes']:
+        node = Node(box_type, value) if box_type == 'char' else Node(box_type)
+        boxes.append(box_class(box_type, True, node, None, width))
+    return boxes
+
+
+def get_random_boxes(rnd, space_widths, other_widths):
+    boxes = list()
+    for j in range(rnd.randint(0, 40)):
+        kind = rnd.random()
+        if kind < 0.3:
+            boxes.append(['char', ' ', rnd.choice(space_widths)])
+        elif kind < 0.4:
+            boxes.append([rnd.choice(['eol', 'end']), None, 1])
+        elif kind < 0.7:
+            boxes.append(['char', 'a', rnd.choice(other_widths)])
+        else:
+            boxes.append([rnd.choice(['word', 'widget']), None, rnd.choice(other_widths)])
+    return boxes
+
+
+def get_long_boxes(rnd, get_char_width):
+    boxes = list()
+    for j in range(500):
+        if rnd.random() < 0.15:
+            boxes.append(['char', ' ', 4])
+        elif rnd.random() < 0.02:
+            boxes.append(['widget', None, rnd.randint(20, 300)])
+        else:
+            boxes.append(['char', 'a', get_char_width()])
+    boxes.append(['eol', None, 1])
+    return boxes
+
+
+def generate_corpus():
+    rnd = random.Random(1)
+    cases = list()
+    for i in range(300):
+        boxes = get_random_boxes(rnd, [0, 1, 3, 5, 30], [0, 2, 4, 7, 25, 60])
+        cases.append({'layout_width': rnd.choice([1, 5, 10, 20, 50]), 'boxes': boxes})
+    for i in range(6):
+        boxes = get_long_boxes(rnd, lambda: rnd.randint(5, 11))
+        cases.append({'layout_width': rnd.choice([300, 600, 900]), 'boxes': boxes})
+    for i in range(300):
+        boxes = get_random_boxes(rnd, [0, 0.1, 0.7, 3.3, 5, 30.1], [0, 0.2, 2.5, 4.1, 7.3, 25.9, 60])
+        cases.append({'layout_width': rnd.choice([1, 5, 10, 20.5, 50]), 'boxes': boxes})
+    for i in range(60):
+        boxes = get_long_boxes(rnd, lambda: rnd.randint(50, 110) / 10)
+        cases.append({'layout_width': rnd.choice([300, 600, 900]), 'boxes': boxes})
+
+    module = get_baseline_layout_module()
+    for case in cases:
+        case['breaks'] = get_baseline_line_breaks(module, case)
+    with open(corpus_filename, 'w') as f:
+        f.write('[\n' + ',\n'.join(json.dumps(case, separators=(',', ':')) for case in cases) + '\n]\n')
+
+
+if '--generate' in sys.argv:
+    generate_corpus()
+
+with open(corpus_filename) as f:
+    cases = json.load(f)
+
+layout = Document(1).layout
+mismatches = 0
+for case in cases:
+    breaks = layout.get_line_breaks(get_boxes(case), case['layout_width'])
+    if breaks != case['breaks']:
+        mismatches += 1
+        print('mismatch at width {0}: expected {1}, get_line_breaks {2}'.format(case['layout_width'], case['breaks'], breaks))
+
+def is_integer_case(case):
+    return all(isinstance(width, int) for box_type, value, width in case['boxes'])
+
+long_cases = [(get_boxes(case), case['layout_width']) for case in cases if len(case['boxes']) > 100 and is_integer_case(case)]
+long_float_cases = [(get_boxes(case), case['layout_width']) for case in cases if len(case['boxes']) > 100 and not is_integer_case(case)]
+
+def get_time(function, cases):
+    times = list()
+    for i in range(20):
+        start = time.perf_counter()
+        for boxes, layout_width in cases:
+            function(boxes, layout_width)
+        times.append(time.perf_counter() - start)
+    return min(times) / len(cases)
+
+print('{0} cases, {1} mismatches'.format(len(cases), mismatches))
+print('summing each line: {0:.1f} us per paragraph of 500 boxes'.format(get_time(layout.get_line_breaks_by_line_sums, long_cases) * 1e6))
+print('get_line_breaks, integer widths: {0:.1f} us per paragraph of 500 boxes'.format(get_time(layout.get_line_breaks, long_cases) * 1e6))
+print('get_line_breaks, other widths: {0:.1f} us per paragraph of 500 boxes'.format(get_time(layout.get_line_breaks, long_float_cases) * 1e6))
+sys.exit(1 if mismatches > 0 else 0)
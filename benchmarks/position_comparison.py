@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+
+# Position comparisons, as done for selections and when sorting positions.
+# Run it on two revisions to compare them:
+#   python3 benchmarks/position_comparison.py
+
+import sys, os.path, random, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lemma.document.document import Document
+from lemma.document.ast import Paragraph, Node
+
+
+def make_document(paragraph_count):
+    document = Document(1)
+    for i in range(paragraph_count):
+        paragraph = Paragraph()
+        for j in range(40):
+            if j % 10 == 5:
+                fraction = Node('mathfraction')
+                for k in range(2):
+                    mathlist = Node('mathlist')
+                    mathlist.append(Node('char', 'x'))
+                    mathlist.append(Node('end'))
+                    fraction.append(mathlist)
+                paragraph.append(fraction)
+            else:
+                paragraph.append(Node('char', 'a'))
+        paragraph.append(Node('eol'))
+        document.ast.append(paragraph)
+    return document
+
+
+document = make_document(2000)
+rnd = random.Random(1)
+
+leaves = list()
+for paragraph in document.ast:
+    for node in paragraph:
+        leaves.append(node)
+        for mathlist in node.children:
+            leaves.extend(mathlist.children)
+node_pairs = [(rnd.choice(leaves), rnd.choice(leaves)) for i in range(3000)]
+positions = [node.get_position() for node in leaves[::7]]
+
+start = time.perf_counter()
+for node_insert, node_selection in node_pairs:
+    document.cursor.node_insert, document.cursor.node_selection = node_insert, node_selection
+    document.cursor.get_first_and_last_node()
+    document.cursor.restore_selection_invariant()
+selection_time = (time.perf_counter() - start) / len(node_pairs)
+
+start = time.perf_counter()
+for i in range(20):
+    sorted(positions)
+    min(positions)
+    max(positions)
+    [position_1 == position_2 for position_1, position_2 in zip(positions, positions[1:])]
+comparison_time = (time.perf_counter() - start) / 20
+
+print('{0} nodes, {1} positions'.format(len(leaves), len(positions)))
+print('sorting, min, max and comparing all positions: {0:.1f} ms'.format(comparison_time * 1e3))
+print('get_first_and_last_node and restore_selection_invariant: {0:.1f} us per call'.format(selection_time * 1e6))
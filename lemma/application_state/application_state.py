@@ -104,6 +104,16 @@ class ApplicationState():
         ApplicationState.last_scroll_scheduled = ApplicationState.frame_time
         ApplicationState.last_scroll_animation_type = animation_type
 
+    # moves the scrolling position along with content that changed height
+    # above the view, without starting a new scrolling animation.
+    def shift_scrolling_position(document_id, y_change):
+        ApplicationState.prev_scrolling_target_y += y_change
+        ApplicationState.scrolling_target_y += y_change
+
+        if document_id in ApplicationState.scrolling_positions:
+            x, y = ApplicationState.scrolling_positions[document_id]
+            ApplicationState.scrolling_positions[document_id] = (x, y + y_change)
+
     def get_scrolling_position(document_id):
         if document_id in ApplicationState.scrolling_positions:
             return ApplicationState.scrolling_positions[document_id]
@@ -15,18 +15,228 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 
-import time
+import bisect, itertools
 
 from lemma.services.node_type_db import NodeTypeDB
+from lemma.services.traversal import Traversal
 import lemma.services.timer as timer
 
 
+# Every child caches its index in the parent. Mutations only record from
+# which index on the cached values may be stale, and these are renumbered the
+# next time an index is needed. A cached index is used only after checking
+# that the child is really at that position, so changes made to the lists
+# directly can't lead to wrong results.
+def get_index(children, parent, child):
+    index = child.index_in_parent
+    if index < len(children) and children[index] is child:
+        return index
+
+    for i in range(parent.index_valid_until, len(children)):
+        children[i].index_in_parent = i
+    parent.index_valid_until = len(children)
+
+    index = child.index_in_parent
+    if index < len(children) and children[index] is child:
+        return index
+
+    for i, node in enumerate(children):
+        node.index_in_parent = i
+    index = child.index_in_parent
+    if index < len(children) and children[index] is child:
+        return index
+    raise ValueError
+
+
+# leaves share one immutable empty tuple as their children, a list is
+# only created once a child is added.
+empty_children = ()
+
+# tag sets are frozensets, shared between all nodes with the same formatting
+interned_tags = dict()
+
+def get_interned_tags(tags):
+    tags = frozenset(tags)
+    if tags not in interned_tags:
+        interned_tags[tags] = tags
+    return interned_tags[tags]
+
+no_tags = get_interned_tags(())
+
+
+# The children of a paragraph are stored in chunks of limited size, so
+# inserting or removing a node only shifts the nodes of one chunk and not
+# those of the whole paragraph. Every node remembers its chunk and its index
+# in it, every chunk its index in the list and the list the offset each chunk
+# starts at. As for the indices above, these are only updated from the first
+# changed chunk on the next time they are needed.
+class NodeChunk():
+
+    __slots__ = ('nodes', 'index_in_parent', 'index_valid_until')
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.index_in_parent = 0
+        self.index_valid_until = 0
+
+        for node in nodes:
+            node.chunk = self
+
+
+class NodeList():
+
+    max_chunk_size = 256
+
+    def __init__(self):
+        self.chunks = []
+        self.starts = []
+        self.length = 0
+        self.chunks_valid_until = 0
+
+    def insert(self, offset, node):
+        if offset >= self.length:
+            self.append(node)
+            return
+
+        chunk_no, local_offset = self.locate(offset)
+        chunk = self.chunks[chunk_no]
+        chunk.nodes.insert(local_offset, node)
+        chunk.index_valid_until = min(chunk.index_valid_until, local_offset)
+        node.chunk = chunk
+        self.length += 1
+        self.chunks_valid_until = min(self.chunks_valid_until, chunk_no + 1)
+
+        if len(chunk.nodes) > NodeList.max_chunk_size:
+            self.split_chunk(chunk_no)
+
+    def append(self, node):
+        if len(self.chunks) == 0 or len(self.chunks[-1].nodes) >= NodeList.max_chunk_size:
+            self.chunks.append(NodeChunk([]))
+            self.starts.append(self.length)
+            self.chunks[-1].index_in_parent = len(self.chunks) - 1
+            if self.chunks_valid_until == len(self.chunks) - 1:
+                self.chunks_valid_until += 1
+
+        chunk = self.chunks[-1]
+        chunk.nodes.append(node)
+        node.chunk = chunk
+        node.index_in_parent = len(chunk.nodes) - 1
+        self.length += 1
+
+    def remove(self, node):
+        index = self.index(node)
+        self.remove_range(index, index + 1)
+
+    def remove_range(self, index_from, index_to):
+        index_from, index_to = max(index_from, 0), min(index_to, self.length)
+        if index_from >= index_to: return
+
+        chunk_no, local_offset = self.locate(index_from)
+        self.chunks_valid_until = min(self.chunks_valid_until, chunk_no)
+        self.length -= index_to - index_from
+
+        remaining = index_to - index_from
+        while remaining > 0:
+            chunk = self.chunks[chunk_no]
+            count = min(remaining, len(chunk.nodes) - local_offset)
+            del(chunk.nodes[local_offset:local_offset + count])
+            chunk.index_valid_until = min(chunk.index_valid_until, local_offset)
+            remaining -= count
+
+            if len(chunk.nodes) == 0:
+                del(self.chunks[chunk_no])
+                del(self.starts[chunk_no])
+            else:
+                chunk_no += 1
+            local_offset = 0
+
+        # many small chunks are left behind by removing single nodes
+        if len(self.chunks) > 2 * (self.length // NodeList.max_chunk_size) + 2:
+            self.rebuild()
+
+    def index(self, node):
+        chunk = node.chunk
+        if chunk == None: raise ValueError
+
+        self.update_chunks()
+        chunk_no = chunk.index_in_parent
+        if chunk_no >= len(self.chunks) or self.chunks[chunk_no] is not chunk: raise ValueError
+
+        return self.starts[chunk_no] + get_index(chunk.nodes, chunk, node)
+
+    def locate(self, index):
+        self.update_chunks()
+        chunk_no = bisect.bisect_right(self.starts, index) - 1
+        return chunk_no, index - self.starts[chunk_no]
+
+    def update_chunks(self):
+        for i in range(self.chunks_valid_until, len(self.chunks)):
+            self.starts[i] = 0 if i == 0 else self.starts[i - 1] + len(self.chunks[i - 1].nodes)
+            self.chunks[i].index_in_parent = i
+        self.chunks_valid_until = len(self.chunks)
+
+    def split_chunk(self, chunk_no):
+        chunk = self.chunks[chunk_no]
+        half = len(chunk.nodes) // 2
+
+        self.chunks.insert(chunk_no + 1, NodeChunk(chunk.nodes[half:]))
+        self.starts.insert(chunk_no + 1, 0)
+        del(chunk.nodes[half:])
+        self.chunks_valid_until = min(self.chunks_valid_until, chunk_no + 1)
+
+    def rebuild(self):
+        nodes = list(self)
+        self.chunks, self.starts, self.length, self.chunks_valid_until = [], [], 0, 0
+        for node in nodes:
+            self.append(node)
+
+    def __len__(self): return self.length
+    def __iter__(self): return itertools.chain.from_iterable([chunk.nodes for chunk in self.chunks])
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            if step != 1:
+                return list(self)[key]
+
+            result = []
+            if start >= stop: return result
+            chunk_no, local_offset = self.locate(start)
+            while len(result) < stop - start:
+                result += self.chunks[chunk_no].nodes[local_offset:local_offset + stop - start - len(result)]
+                chunk_no += 1
+                local_offset = 0
+            return result
+        else:
+            if key < 0:
+                key += self.length
+            if key < 0 or key >= self.length: raise IndexError
+            if key == 0: return self.chunks[0].nodes[0]
+            if key == self.length - 1: return self.chunks[-1].nodes[-1]
+
+            chunk_no, local_offset = self.locate(key)
+            return self.chunks[chunk_no].nodes[local_offset]
+
+    def __delitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            if step != 1: raise ValueError
+            self.remove_range(start, stop)
+        else:
+            if key < 0:
+                key += self.length
+            if key < 0 or key >= self.length: raise IndexError
+            self.remove_range(key, key + 1)
+
+
 class Root():
 
     def __init__(self):
         self.parent = None
         self.paragraphs = []
         self.type = 'root'
+        self.index_valid_until = 0
+        self.version = 0
 
         paragraph = Paragraph()
         paragraph.append(Node('eol'))
@@ -35,19 +245,28 @@ class Root():
     def insert(self, offset, paragraph):
         self.paragraphs.insert(offset, paragraph)
         paragraph.set_parent(self)
+        self.index_valid_until = min(self.index_valid_until, offset)
+        self.version += 1
 
     def append(self, paragraph):
         self.paragraphs.append(paragraph)
         paragraph.set_parent(self)
+        paragraph.index_in_parent = len(self.paragraphs) - 1
+        self.version += 1
 
     def remove(self, paragraph):
-        self.paragraphs.remove(paragraph)
+        index = self.index(paragraph)
+        del(self.paragraphs[index])
+        self.index_valid_until = min(self.index_valid_until, index)
+        self.version += 1
 
     def remove_range(self, index_from, index_to):
         del(self.paragraphs[index_from:index_to])
+        self.index_valid_until = min(self.index_valid_until, index_from)
+        self.version += 1
 
     def index(self, paragraph):
-        return self.paragraphs.index(paragraph)
+        return get_index(self.paragraphs, self, paragraph)
 
     def get_position(self):
         return Position(*list())
@@ -72,19 +291,20 @@ class Paragraph():
 
     def __init__(self):
         self.parent = None
-        self.children = []
+        self.children = NodeList()
         self.type = 'paragraph'
+        self.index_in_parent = 0
 
         self.style = 'p'
         self.indentation_level = 0
         self.state = None
 
-        self.last_modified = 0
-
-    def update_last_modified(self):
-        self.last_modified = time.time()
+        self.version = 0
 
     def set_parent(self, parent):
+        if parent is not self.parent:
+            for node in self.children:
+                node.clear_cached_ancestors()
         self.parent = parent
 
     def insert(self, offset, node):
@@ -99,7 +319,7 @@ class Paragraph():
         self.children.remove(node)
 
     def remove_range(self, index_from, index_to):
-        del(self.children[index_from:index_to])
+        self.children.remove_range(index_from, index_to)
 
     def index(self, node):
         return self.children.index(node)
@@ -132,59 +352,88 @@ class Paragraph():
     def __iter__(self): return self.children.__iter__()
 
     def __getitem__(self, key):
-        if isinstance(key, slice):
-            return self.children.__getitem__(key)
-        else:
-            return self.children.__getitem__(key)
+        return self.children.__getitem__(key)
 
 
 class Node():
 
+    __slots__ = ('parent', 'children', 'type', 'index_in_parent', 'index_valid_until', 'chunk', 'cached_ancestors', 'value', 'tags', 'link')
+
     def __init__(self, type_str, value=None):
         self.parent = None
-        self.children = []
+        self.children = empty_children
         self.type = type_str
+        self.index_in_parent = 0
+        self.index_valid_until = 0
+        self.chunk = None
+        self.cached_ancestors = None
         self.value = value
-        self.tags = set()
+        self.tags = no_tags
         self.link = None
 
     def set_parent(self, parent):
+        if parent is not self.parent:
+            self.clear_cached_ancestors()
         self.parent = parent
 
+    # a node only caches its ancestors after its parent did, so the
+    # descendants without a cache can be skipped.
+    def clear_cached_ancestors(self):
+        self.cached_ancestors = None
+        for child in self.children:
+            if child.cached_ancestors != None:
+                child.clear_cached_ancestors()
+
     def insert(self, offset, node):
+        if self.children is empty_children:
+            self.children = []
         self.children.insert(offset, node)
         node.set_parent(self)
+        self.index_valid_until = min(self.index_valid_until, offset)
 
     def append(self, node):
+        if self.children is empty_children:
+            self.children = []
         self.children.append(node)
         node.set_parent(self)
+        node.index_in_parent = len(self.children) - 1
 
     def remove(self, node):
-        self.children.remove(node)
+        index = self.index(node)
+        del(self.children[index])
+        self.index_valid_until = min(self.index_valid_until, index)
 
     def remove_range(self, index_from, index_to):
         del(self.children[index_from:index_to])
+        self.index_valid_until = min(self.index_valid_until, index_from)
 
     def index(self, node):
-        return self.children.index(node)
+        return get_index(self.children, self, node)
 
     def get_position(self):
         node = self
         position = list()
         while not node.type == 'root':
-            position.insert(0, node.parent.index(node))
+            position.append(node.parent.index(node))
             node = node.parent
+        position.reverse()
 
         return Position(*position)
 
     def ancestors(self):
-        node = self
-        ancestors = []
-        while not node.type == 'root':
-            ancestors.insert(0, node.parent)
-            node = node.parent
+        parent = self.parent
+        if parent.type == 'paragraph':
+            return [parent.parent, parent]
+        return list(self.get_cached_ancestors())
+
+    def get_cached_ancestors(self):
+        parent = self.parent
+        if parent.type == 'paragraph':
+            return (parent.parent, parent)
 
-        return ancestors
+        if self.cached_ancestors == None:
+            self.cached_ancestors = parent.get_cached_ancestors() + (parent,)
+        return self.cached_ancestors
 
     def is_first_in_parent(self):
         return self == self.parent[0]
@@ -244,12 +493,9 @@ class Node():
         return (node1, node2)
 
     def paragraph(self):
-        node = self
-
-        while not node.type == 'paragraph':
-            node = node.parent
-
-        return node
+        if self.parent.type == 'paragraph':
+            return self.parent
+        return self.get_cached_ancestors()[1]
 
     def prev_in_parent(self):
         if not self.is_first_in_parent():
@@ -358,10 +604,7 @@ class Node():
         return self.paragraph()[-1]
 
     def flatten(self):
-        result = [self]
-        for child in self.children:
-            result += child.flatten()
-        return result
+        return list(Traversal.pre_order(self))
 
     def __len__(self):
         return len(self.children)
@@ -380,37 +623,14 @@ class Node():
         return string
 
 
-class Position(object):
-
-    def __init__(self, *level_positions):
-        self.level_positions = list(level_positions)
-
-    def __str__(self): return self.level_positions.__str__()
-    def __len__(self): return len(self.level_positions)
-    def __iter__(self): return self.level_positions.__iter__()
-    def __getitem__(self, key): return self.level_positions.__getitem__(key)
-    def __eq__(self, other): return not self.__ne__(other)
-    def __ne__(self, other): return other == None or self.__lt__(other) or self.__gt__(other)
-    def __le__(self, other): return not self.__gt__(other)
-    def __gt__(self, other): return other.__lt__(self)
-    def __ge__(self, other): return not self.__lt__(other)
-
-    def __lt__(self, other):
-        if len(self) < len(other):
-            for i in range(len(self)):
-                if self[i] < other[i]: return True
-                if self[i] > other[i]: return False
-            return True
-        if len(self) > len(other):
-            for i in range(len(other)):
-                if self[i] < other[i]: return True
-                if self[i] > other[i]: return False
-            return False
-        else:
-            for i in range(len(self)):
-                if self[i] < other[i]: return True
-                if self[i] > other[i]: return False
-            return False
+# positions are tuples, so they are compared and hashed natively. They are
+# printed like lists, as this is how they are stored in the document meta.
+class Position(tuple):
+
+    def __new__(cls, *level_positions):
+        return tuple.__new__(cls, level_positions)
+
+    def __str__(self): return list(self).__str__()
 
 
 class Cursor():
@@ -485,8 +705,7 @@ class Cursor():
         if len(pos1) > len(ancestor_1_pos) + 1:
             pos1 = pos1[:len(ancestor_1_pos) + 1]
         if len(pos2) > len(ancestor_2_pos) + 1:
-            pos2 = pos2[:len(ancestor_2_pos) + 1]
-            pos2[-1] += 1
+            pos2 = pos2[:len(ancestor_2_pos)] + (pos2[len(ancestor_2_pos)] + 1,)
 
         # move both insert and selection bound to either a common ancestor or a paragraph
         if self.get_insert_node() == first_node:
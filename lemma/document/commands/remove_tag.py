@@ -15,6 +15,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 
+from lemma.document.ast import get_interned_tags
+
 
 class Command():
 
@@ -29,7 +31,7 @@ class Command():
             for node in document.get_selected_nodes():
                 if self.tag_name in node.tags:
                     self.state['affected_nodes'].append(node)
-                    node.tags.remove(self.tag_name)
+                    node.tags = get_interned_tags(node.tags - {self.tag_name})
 
             for paragraph_no in range(document.ast.index(document.get_first_selection_bound().paragraph()), document.ast.index(document.get_last_selection_bound().paragraph()) + 1):
                 document.invalidate_paragraph(document.ast[paragraph_no])
@@ -37,7 +39,7 @@ class Command():
 
     def undo(self, document):
         for node in self.state['affected_nodes']:
-            node.tags.add(self.tag_name)
+            node.tags = get_interned_tags(node.tags | {self.tag_name})
 
         if len(self.state['affected_nodes']) > 0:
             for paragraph_no in range(document.ast.index(self.state['affected_nodes'][0].paragraph()), document.ast.index(self.state['affected_nodes'][-1].paragraph()) + 1):
@@ -19,6 +19,7 @@ import time
 
 import lemma.services.xml_helpers as xml_helpers
 from lemma.services.xml_parser import XMLParser
+from lemma.services.xml_exporter import XMLExporter
 from lemma.document.ast import Root, Cursor
 from lemma.document.command_manager import CommandManager
 from lemma.services.character_db import CharacterDB
@@ -26,6 +27,7 @@ from lemma.document.plaintext import Plaintext
 from lemma.document.links import Links
 from lemma.document.files import Files
 from lemma.document.xml import XML
+from lemma.document.snapshot import Snapshots
 from lemma.document.layout import Layout
 from lemma.services.ast_validator import ASTValidator
 from lemma.services.node_type_db import NodeTypeDB
@@ -34,10 +36,16 @@ import lemma.services.timer as timer
 
 class Document():
 
+    max_paragraph_changes = 1000
+
     def __init__(self, id=None):
         self.last_modified = time.time()
         self.last_cursor_movement = time.time()
 
+        self.revision = 0
+        self.paragraph_changes = list()
+        self.paragraph_changes_complete_after = 0
+
         self.id = id
         self.title = ''
         self.ast = Root()
@@ -47,9 +55,9 @@ class Document():
         self.links = Links(self)
         self.files = Files(self)
         self.xml = XML(self)
+        self.snapshots = Snapshots(self)
         self.layout = Layout(self)
 
-        self.secondary_formats_cache = dict()
         self.query_cache = dict()
 
         self.command_manager = CommandManager(self)
@@ -237,19 +245,39 @@ class Document():
     def update_last_modified(self):
         self.last_modified = time.time()
         self.last_cursor_movement = time.time()
+        self.revision += 1
         self.query_cache = dict()
-        self.secondary_formats_cache = dict()
 
     def update_last_cursor_movement(self):
         self.last_cursor_movement = time.time()
         self.query_cache = dict()
 
+    # derived formats remember the revision they were computed for, and per
+    # paragraph the version of the paragraph. Recent changes are logged, so
+    # they can look at only the paragraphs that changed since.
     def invalidate_paragraph(self, paragraph):
-        self.plaintext.invalidate_paragraph(paragraph)
-        self.links.invalidate_paragraph(paragraph)
-        self.files.invalidate_paragraph(paragraph)
-        self.xml.invalidate_paragraph(paragraph)
-        paragraph.update_last_modified()
+        self.revision += 1
+        paragraph.version = self.revision
+
+        self.paragraph_changes.append((self.revision, paragraph))
+        if len(self.paragraph_changes) > 2 * Document.max_paragraph_changes:
+            self.paragraph_changes_complete_after = self.paragraph_changes[-Document.max_paragraph_changes - 1][0]
+            del(self.paragraph_changes[:-Document.max_paragraph_changes])
+
+    def get_ast_version(self):
+        return (self.ast, self.ast.version)
+
+    # returns None if paragraphs were added or removed since, or the log
+    # doesn't reach back to the given revision.
+    def get_paragraphs_changed_since(self, revision, ast_version):
+        if revision == None or revision < self.paragraph_changes_complete_after: return None
+        if ast_version != self.get_ast_version(): return None
+
+        paragraphs = list()
+        for change_revision, paragraph in reversed(self.paragraph_changes):
+            if change_revision <= revision: break
+            paragraphs.append(paragraph)
+        return paragraphs
 
     def has_multiple_lines_selected(self):
         if 'multiple_lines_selected' not in self.query_cache:
@@ -386,47 +414,32 @@ class Document():
         return result
 
     def get_files(self):
-        if 'files' not in self.secondary_formats_cache:
-            self.files.update()
-            self.secondary_formats_cache['files'] = self.files.files
-        return self.secondary_formats_cache['files']
+        self.files.update()
+        return self.files.files
 
     def get_links(self):
-        if 'links' not in self.secondary_formats_cache:
-            self.links.update()
-            self.secondary_formats_cache['links'] = self.links.links
-        return self.secondary_formats_cache['links']
+        self.links.update()
+        return self.links.links
 
     def get_plaintext(self):
-        if 'plaintext' not in self.secondary_formats_cache:
-            self.plaintext.update()
-            self.secondary_formats_cache['plaintext'] = self.plaintext.plaintext
-        return self.secondary_formats_cache['plaintext']
+        return self.plaintext.get_plaintext()
 
     def get_layout(self, preedit_string, font_theme):
-        if 'layout' not in self.secondary_formats_cache:
-            self.layout.update()
-            self.secondary_formats_cache['layout'] = self.layout
-        elif self.layout.preedit_string != preedit_string or self.layout.font_theme != font_theme:
+        if self.layout.preedit_string != preedit_string or self.layout.font_theme != font_theme:
             self.layout.update_font_theme(font_theme)
             self.layout.update_preedit(preedit_string)
-            self.layout.update()
-        return self.secondary_formats_cache['layout']
+        self.layout.update()
+        return self.layout
+
+    def get_snapshot(self):
+        self.snapshots.update()
+        return self.snapshots.snapshot
 
     @timer.timer
     def get_xml(self):
-        if 'xml' not in self.secondary_formats_cache:
-            self.xml.update()
-            xml = '<head>'
-            xml += '<title>' + xml_helpers.escape(self.title) + '</title>'
-            xml += '<meta name="insert-position" content="' + str(self.get_cursor_state()[0]) + '" />'
-            xml += '<meta name="selection-position" content="' + str(self.get_cursor_state()[1]) + '" />'
-            xml += '</head>'
-            xml += '<root>'
-            for paragraph in self.ast:
-                xml += self.xml.paragraph_xml[paragraph]
-            xml += '</root>'
-            self.secondary_formats_cache['xml'] = xml
-        return self.secondary_formats_cache['xml']
+        self.xml.update()
+        if self.xml.xml == None:
+            self.xml.xml = XMLExporter.join_document(*self.xml.snapshot)
+        return self.xml.xml
 
 
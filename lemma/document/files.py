@@ -18,28 +18,68 @@
 import lemma.services.timer as timer
 
 
+# Counts the paragraphs using each file, so that only changed paragraphs have
+# to be looked at. Like the links, the set of files is never changed in place.
 class Files(object):
 
     def __init__(self, document):
         self.document = document
 
         self.paragraph_files = dict()
+        self.file_counts = dict()
         self.files = set()
-
-    def invalidate_paragraph(self, paragraph):
-        if paragraph in self.paragraph_files:
-            del(self.paragraph_files[paragraph])
+        self.revision = None
+        self.ast_version = None
 
     @timer.timer
     def update(self):
-        self.files = set()
+        if self.revision == self.document.revision: return
+
+        added_or_removed = set()
+        paragraphs = self.document.get_paragraphs_changed_since(self.revision, self.ast_version)
+        if paragraphs == None:
+            paragraphs = self.document.ast
+            current_paragraphs = set(paragraphs)
+            for paragraph in [paragraph for paragraph in self.paragraph_files if paragraph not in current_paragraphs]:
+                added_or_removed |= self.remove_files(self.paragraph_files[paragraph][1])
+                del(self.paragraph_files[paragraph])
+            for paragraph in current_paragraphs:
+                if paragraph not in self.paragraph_files:
+                    self.paragraph_files[paragraph] = (None, set())
 
-        for paragraph in self.document.ast:
-            if paragraph not in self.paragraph_files:
-                self.paragraph_files[paragraph] = set()
+        for paragraph in paragraphs:
+            if paragraph in self.paragraph_files and self.paragraph_files[paragraph][0] != paragraph.version:
+                files = set()
                 for node in paragraph:
                     if node.type == 'widget':
-                        self.paragraph_files[paragraph] |= node.value.get_filenames()
-            self.files |= self.paragraph_files[paragraph]
+                        files |= node.value.get_filenames()
+                added_or_removed |= self.remove_files(self.paragraph_files[paragraph][1])
+                added_or_removed |= self.add_files(files)
+                self.paragraph_files[paragraph] = (paragraph.version, files)
+
+        # a paragraph keeping its files removes and adds them again, so
+        # the set is only replaced if a file really appeared or disappeared.
+        if any((file in self.file_counts) != (file in self.files) for file in added_or_removed):
+            self.files = set(self.file_counts)
+        self.revision = self.document.revision
+        self.ast_version = self.document.get_ast_version()
+
+    def add_files(self, files):
+        added = set()
+        for file in files:
+            if file not in self.file_counts:
+                self.file_counts[file] = 0
+                added.add(file)
+            self.file_counts[file] += 1
+        return added
+
+    def remove_files(self, files):
+        removed = set()
+        for file in files:
+            self.file_counts[file] -= 1
+            if self.file_counts[file] == 0:
+                del(self.file_counts[file])
+                removed.add(file)
+        return removed
 
 
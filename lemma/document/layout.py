@@ -15,17 +15,23 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 
-import time
+import math, itertools, bisect
 
 from lemma.services.node_type_db import NodeTypeDB
 from lemma.services.text_shaper import TextShaper
 from lemma.services.character_db import CharacterDB
 from lemma.services.layout_info import LayoutInfo
+from lemma.services.traversal import Traversal
+from lemma.services.prefix_sum_tree import PrefixSumTree
+from lemma.services.lru_cache import LRUCache
 import lemma.services.timer as timer
 
 
 class Layout(object):
 
+    viewport_margin = 1000
+    max_cached_lookups = 256
+
     def __init__(self, document):
         self.document = document
         self.ast = document.ast
@@ -33,66 +39,136 @@ class Layout(object):
         self.preedit_string = ''
 
         self.layouts = dict()
+        self.heights = PrefixSumTree()
+        self.paragraph_ys = dict()
+        self.outdated_paragraphs = set()
         self.paragraph_with_preedit = None
 
-        self.line_layouts_by_y = dict()
-        self.leaf_layouts_by_xy = dict()
+        self.line_layouts_by_y = LRUCache(Layout.max_cached_lookups)
+        self.leaf_layouts_by_xy = LRUCache(Layout.max_cached_lookups)
 
-        self.last_updated = 0
+        self.revision = None
+        self.ast_version = None
         self.is_valid = False
 
         self.current_paragraph_style = None
         self.current_node_layouts = dict()
 
     def get_height(self):
-        layout = self.get_paragraph_layout(self.ast[-1])
-        return layout['y'] + layout['height']
+        return self.heights.get_total()
 
     def get_width(self):
-        return self.get_paragraph_layout(self.ast[0])['width']
+        return self.get_paragraph_layout(self.ast[0]).width
 
     def get_paragraph_layout(self, paragraph):
         if paragraph in self.layouts:
+            if self.layouts[paragraph]['paragraph'] == None:
+                self.replace_estimate(paragraph)
             return self.layouts[paragraph]['paragraph']
         return None
 
+    def get_paragraph_extents(self, paragraph):
+        return self.get_paragraph_y(paragraph), self.layouts[paragraph]['height']
+
+    def get_paragraph_y(self, paragraph):
+        if paragraph not in self.paragraph_ys:
+            self.paragraph_ys[paragraph] = self.heights.get_prefix_sum(self.ast.index(paragraph))
+        return self.paragraph_ys[paragraph]
+
     def get_node_layout(self, node):
         paragraph = node.paragraph()
-        if paragraph in self.layouts and node in self.layouts[paragraph]['nodes']:
-            return self.layouts[paragraph]['nodes'][node]
+        if paragraph in self.layouts:
+            if self.layouts[paragraph]['paragraph'] == None:
+                self.replace_estimate(paragraph)
+            if node in self.layouts[paragraph]['nodes']:
+                return self.layouts[paragraph]['nodes'][node]
         return None
 
+    # lines are returned nearest first, laying out paragraphs only as they are reached.
+    def get_lines_above(self, line):
+        paragraph_layout = line.parent
+        lines = paragraph_layout.children
+        yield from reversed(lines[:lines.index(line)])
+
+        index = self.ast.index(paragraph_layout.node)
+        for paragraph in reversed(self.ast[:index]):
+            yield from reversed(self.get_paragraph_layout(paragraph).children)
+
+    def get_lines_below(self, line):
+        paragraph_layout = line.parent
+        lines = paragraph_layout.children
+        yield from lines[lines.index(line) + 1:]
+
+        index = self.ast.index(paragraph_layout.node)
+        for paragraph in self.ast[index + 1:]:
+            yield from self.get_paragraph_layout(paragraph).children
+
+    # leaves can overlap (in fractions, scripts and roots), in which case the
+    # last one in pre-order is returned.
     def get_leaf_layout_at_xy(self, x, y):
         if (x, y) not in self.leaf_layouts_by_xy:
             line = self.get_line_layout_at_y(y)
+            paragraph_y = line.parent.y
 
-            self.leaf_layouts_by_xy[(x, y)] = None
-            if y >= line['y'] + line['parent']['y'] and y < line['y'] + line['parent']['y'] + line['height']:
-                for layout in self.flatten_layout(line):
-                    if layout['node'] != None and layout['node'].type in {'char', 'widget', 'placeholder', 'eol', 'end'}:
-                        layout_x, layout_y = self.get_absolute_xy(layout)
-                        if x >= layout_x and x <= layout_x + layout['width'] and y >= layout_y and y <= layout_y + layout['height']:
-                            self.leaf_layouts_by_xy[(x, y)] = layout
+            result = None
+            if y >= line.y + paragraph_y and y < line.y + paragraph_y + line.height:
+                x_starts, leaves, max_width = self.get_leaf_index(line)
+
+                result_order = -1
+                for i in range(bisect.bisect_left(x_starts, x - max_width - 1), bisect.bisect_right(x_starts, x)):
+                    order, layout_x, layout_y, layout = leaves[i]
+                    layout_y += paragraph_y
+                    if order > result_order and x <= layout_x + layout.width and y >= layout_y and y <= layout_y + layout.height:
+                        result, result_order = layout, order
+            self.leaf_layouts_by_xy[(x, y)] = result
 
         return self.leaf_layouts_by_xy[(x, y)]
 
+    # the leaves of a line sorted by their x offset, with the y offset relative
+    # to the paragraph, which stays the same when paragraphs above change.
+    def get_leaf_index(self, line):
+        entry = self.layouts[line.parent.node]
+        line_index = bisect.bisect_right(entry['line_offsets'], line.y) - 1
+
+        if line_index not in entry['leaf_indexes']:
+            leaves = list()
+            max_width = 0
+            for order, layout in enumerate(Traversal.layout_pre_order(line)):
+                if layout.node != None and layout.node.type in {'char', 'widget', 'placeholder', 'eol', 'end'}:
+                    layout_x, layout_y = 0, 0
+                    ancestor = layout
+                    while ancestor.parent != None:
+                        layout_x += ancestor.x
+                        layout_y += ancestor.y
+                        ancestor = ancestor.parent
+                    layout_x += ancestor.x
+
+                    leaves.append((layout_x, order, layout_y, layout))
+                    max_width = max(max_width, layout.width)
+            leaves.sort(key=lambda leaf: leaf[:2])
+
+            x_starts = [leaf[0] for leaf in leaves]
+            leaves = [(order, layout_x, layout_y, layout) for layout_x, order, layout_y, layout in leaves]
+            entry['leaf_indexes'][line_index] = (x_starts, leaves, max_width)
+
+        return entry['leaf_indexes'][line_index]
+
     def get_cursor_holding_layout_close_to_xy(self, x, y):
         if y < 0: x = 0
         if y > self.get_height(): x = LayoutInfo.get_max_layout_width()
 
         hbox = self.get_line_layout_at_y(y)
-        if y >= hbox['y'] + hbox['parent']['y'] and y < hbox['y'] + hbox['parent']['y'] + hbox['height']:
-            for layout in self.flatten_layout(hbox):
-                if layout['type'] == 'hbox':
-                    layout_x, layout_y = self.get_absolute_xy(layout)
-                    if x >= layout_x and x <= layout_x + layout['width'] \
-                            and y >= layout_y and y <= layout_y + layout['height'] \
-                            and hbox in self.get_ancestors(layout):
-                        hbox = layout
+        if y >= hbox.y + hbox.parent.y and y < hbox.y + hbox.parent.y + hbox.height:
+            for layout in Traversal.layout_by_type(hbox, {'hbox'}):
+                layout_x, layout_y = self.get_absolute_xy(layout)
+                if x >= layout_x and x <= layout_x + layout.width \
+                        and y >= layout_y and y <= layout_y + layout.height \
+                        and hbox in self.get_ancestors(layout):
+                    hbox = layout
 
         closest_layout = None
         min_distance = 10000
-        for layout in hbox['children']:
+        for layout in hbox.children:
             layout_x, layout_y = self.get_absolute_xy(layout)
             distance = abs(layout_x - x)
             if distance < min_distance:
@@ -101,43 +177,44 @@ class Layout(object):
 
         return closest_layout
 
+    # replacing an estimate changes the height of the document, so y can end
+    # up below the last paragraph while estimates are replaced.
     def get_line_layout_at_y(self, y):
         if y not in self.line_layouts_by_y:
+            index = self.heights.find(y)
+            while index < len(self.ast) and self.layouts[self.ast[index]]['paragraph'] == None:
+                self.replace_estimate(self.ast[index])
+                index = self.heights.find(y)
+
             if y < 0:
                 layout = self.get_paragraph_layout(self.ast[0])
-                self.line_layouts_by_y[y] = layout['children'][0]
-            elif y > self.get_height():
+                self.line_layouts_by_y[y] = layout.children[0]
+            elif index == len(self.ast):
                 layout = self.get_paragraph_layout(self.ast[-1])
-                self.line_layouts_by_y[y] = layout['children'][-1]
+                self.line_layouts_by_y[y] = layout.children[-1]
             else:
-                for paragraph in self.ast:
-                    layout = self.get_paragraph_layout(paragraph)
-                    if y >= layout['y'] and y < layout['y'] + layout['height']:
-                        for line in layout['children']:
-                            if y - layout['y'] >= line['y'] and y - layout['y'] < line['y'] + line['height']:
-                                self.line_layouts_by_y[y] = line
+                paragraph = self.ast[index]
+                layout = self.get_paragraph_layout(paragraph)
+                index = bisect.bisect_right(self.layouts[paragraph]['line_offsets'], y - layout.y) - 1
+                line = layout.children[index]
+                if index >= 0 and y - layout.y < line.y + line.height:
+                    self.line_layouts_by_y[y] = line
 
         return self.line_layouts_by_y[y]
 
-    def flatten_layout(self, layout_tree):
-        result = [layout_tree]
-        for child in layout_tree['children']:
-            result += self.flatten_layout(child)
-        return result
-
     def get_ancestors(self, layout):
         ancestors = []
-        while layout['parent'] != None:
-            ancestors.append(layout['parent'])
-            layout = layout['parent']
+        while layout.parent != None:
+            ancestors.append(layout.parent)
+            layout = layout.parent
         return ancestors
 
     def get_absolute_xy(self, layout):
         x, y = (0, 0)
         while not layout == None:
-            x += layout['x']
-            y += layout['y']
-            layout = layout['parent']
+            x += layout.x
+            y += layout.y
+            layout = layout.parent
 
         return x, y
 
@@ -146,6 +223,7 @@ class Layout(object):
             self.font_theme = font_theme
 
             self.layouts = dict()
+            self.revision = None
             self.is_valid = False
 
     def update_preedit(self, preedit_string):
@@ -155,73 +233,139 @@ class Layout(object):
             insert = self.document.get_insert_node()
             paragraph = insert.paragraph()
             if paragraph in self.layouts:
-                del(self.layouts[paragraph])
+                self.layouts[paragraph]['version'] = None
+                self.outdated_paragraphs.add(paragraph)
             if self.paragraph_with_preedit in self.layouts:
-                del(self.layouts[self.paragraph_with_preedit])
+                self.layouts[self.paragraph_with_preedit]['version'] = None
+                self.outdated_paragraphs.add(self.paragraph_with_preedit)
                 self.paragraph_with_preedit = None
             self.is_valid = False
 
+    # paragraphs that weren't laid out before only get an estimated height here.
+    # they are laid out when they come close to the viewport, or when their
+    # layout is asked for, so the cost of opening a document or changing the
+    # font theme doesn't depend on the length of the document.
+    # the heights of all paragraphs are kept in a prefix sum tree, so as long
+    # as no paragraphs were added or removed, only changed paragraphs are visited.
     @timer.timer
     def update(self):
-        if self.document.last_modified <= self.last_updated and self.is_valid: return
+        if self.document.revision == self.revision and self.is_valid: return
+
+        insert_paragraph = self.document.get_insert_node().paragraph()
+
+        paragraphs = self.document.get_paragraphs_changed_since(self.revision, self.ast_version)
+        if paragraphs == None:
+            layouts = dict()
+            heights = list()
+            for paragraph in self.ast:
+                entry = self.layouts.get(paragraph)
+                if entry == None or entry['version'] != paragraph.version:
+                    entry = self.renew_entry(paragraph, entry, insert_paragraph)
+                layouts[paragraph] = entry
+                heights.append(entry['height'])
+            self.layouts = layouts
+            self.heights = PrefixSumTree(heights)
+            self.invalidate_offsets()
+        else:
+            for paragraph in itertools.chain(paragraphs, self.outdated_paragraphs):
+                entry = self.layouts[paragraph]
+                if entry['version'] != paragraph.version:
+                    entry = self.renew_entry(paragraph, entry, insert_paragraph)
+                    self.layouts[paragraph] = entry
+                    self.set_height(paragraph, entry['height'])
+
+        self.outdated_paragraphs = set()
+        self.line_layouts_by_y.clear()
+        self.leaf_layouts_by_xy.clear()
+        self.revision = self.document.revision
+        self.ast_version = self.document.get_ast_version()
+        self.is_valid = True
+
+    # paragraphs that were laid out before are likely to be on screen.
+    def renew_entry(self, paragraph, previous_entry, insert_paragraph):
+        if paragraph == insert_paragraph or (previous_entry != None and previous_entry['paragraph'] != None):
+            return self.make_paragraph_layout(paragraph)
+        return self.estimate_paragraph_layout(paragraph)
 
+    # estimates of paragraphs above the view are replaced as well, which moves
+    # the paragraphs in view. returns by how much, so the scrolling offset can
+    # follow and the view doesn't jump.
+    @timer.timer
+    def update_viewport(self, y_from, y_to):
+        offset_change = 0
+
+        index = self.heights.find(y_from - Layout.viewport_margin)
+        y_offset = self.heights.get_prefix_sum(index)
+        while index < len(self.ast) and y_offset <= y_to + offset_change + Layout.viewport_margin:
+            paragraph = self.ast[index]
+            if self.layouts[paragraph]['paragraph'] == None:
+                estimated_height = self.layouts[paragraph]['height']
+                self.replace_estimate(paragraph)
+                if y_offset + estimated_height <= y_from + offset_change:
+                    offset_change += self.layouts[paragraph]['height'] - estimated_height
+            y_offset += self.layouts[paragraph]['height']
+            index += 1
+        return offset_change
+
+    def replace_estimate(self, paragraph):
+        entry = self.make_paragraph_layout(paragraph)
+        self.layouts[paragraph] = entry
+        self.set_height(paragraph, entry['height'])
+
+    def set_height(self, paragraph, height):
+        self.heights.set(self.ast.index(paragraph), height)
+        self.invalidate_offsets()
+
+    def invalidate_offsets(self):
+        self.paragraph_ys = dict()
+        self.line_layouts_by_y.clear()
+        self.leaf_layouts_by_xy.clear()
+
+    def make_paragraph_layout(self, paragraph):
         insert = self.document.get_insert_node()
-        insert_paragraph = insert.paragraph()
-
-        y_offset = 0
-        for paragraph in self.ast:
-            if paragraph not in self.layouts or paragraph.last_modified > self.last_updated:
-                indentation = LayoutInfo.get_indentation(paragraph.style, paragraph.indentation_level)
-                width = LayoutInfo.get_max_layout_width() - indentation
-
-                layout_tree, node_layouts = self.make_layout_tree_paragraph(self.ast, paragraph)
-                if paragraph == insert_paragraph:
-                    if len(self.preedit_string) > 0:
-                        self.add_preedit(layout_tree, insert, self.preedit_string)
-                        self.paragraph_with_preedit = paragraph
-
-                self.layout_paragraph(layout_tree, width, indentation)
-                self.layouts[paragraph] = {'paragraph': layout_tree, 'nodes': node_layouts}
-            else:
-                layout_tree = self.layouts[paragraph]['paragraph']
-            layout_tree['y'] = y_offset
-            y_offset += layout_tree['height']
+        indentation = LayoutInfo.get_indentation(paragraph.style, paragraph.indentation_level)
+        width = LayoutInfo.get_max_layout_width() - indentation
 
-        self.line_layouts_by_y = dict()
-        self.leaf_layouts_by_xy = dict()
-        self.last_updated = time.time()
-        self.is_valid = True
+        layout_tree, node_layouts = self.make_layout_tree_paragraph(self.ast, paragraph)
+        if paragraph == insert.paragraph():
+            if len(self.preedit_string) > 0:
+                self.add_preedit(layout_tree, insert, self.preedit_string)
+                self.paragraph_with_preedit = paragraph
+
+        self.layout_paragraph(layout_tree, width, indentation)
+
+        line_offsets = [line.y for line in layout_tree.children]
+        return {'paragraph': layout_tree, 'nodes': node_layouts, 'version': paragraph.version, 'height': layout_tree.height, 'line_offsets': line_offsets, 'leaf_indexes': dict()}
+
+    def estimate_paragraph_layout(self, paragraph):
+        fontname = paragraph.style if paragraph.style.startswith('h') else 'body'
+        width = LayoutInfo.get_max_layout_width() - LayoutInfo.get_indentation(paragraph.style, paragraph.indentation_level)
+        char_width, line_height = TextShaper.measure_single('n', fontname=fontname)
+        line_count = max(1, math.ceil(len(paragraph) * char_width / width))
+
+        return {'paragraph': None, 'nodes': None, 'version': paragraph.version, 'height': line_count * line_height}
 
     @timer.timer
     def make_layout_tree_paragraph(self, root, paragraph):
         self.current_paragraph_style = paragraph.style
         self.current_node_layouts = dict()
 
-        layout_tree = {'type': 'paragraph',
-                       'fixed': False,
-                       'node': paragraph,
-                       'parent': None,
-                       'children': [],
-                       'x': 0,
-                       'y': 0,
-                       'width': 0,
-                       'height': 0,
-                       'fontname': None}
+        layout_tree = ParagraphBox(self, paragraph)
 
         for child in self.group_words(paragraph.children):
             if isinstance(child, list):
                 char_nodes = child
                 text = ''.join([char.value for char in char_nodes])
                 fontname = self.get_fontname_from_node(char_nodes[0])
-                subtree = {'type': 'word', 'fixed': False, 'node': root, 'parent': layout_tree, 'children': [], 'x': 0, 'y': 0, 'width': 0, 'height': 0, 'fontname': fontname}
+                subtree = Box('word', False, root, layout_tree, fontname=fontname)
                 for char_node, extents in zip(char_nodes, TextShaper.measure(text, fontname=fontname)):
-                    subsubtree = {'type': 'char', 'fixed': True, 'node': char_node, 'parent': subtree, 'children': [], 'x': 0, 'y': 0, 'width': extents[0], 'height': extents[1], 'fontname': fontname}
+                    subsubtree = Box('char', True, char_node, subtree, extents[0], extents[1], fontname)
                     self.current_node_layouts[char_node] = subsubtree
-                    subtree['children'].append(subsubtree)
+                    subtree.children.append(subsubtree)
             else:
                 subtree = self.make_layout_tree(child, layout_tree)
 
-            layout_tree['children'].append(subtree)
+            layout_tree.children.append(subtree)
 
         return layout_tree, self.current_node_layouts
 
@@ -229,89 +373,80 @@ class Layout(object):
         if node.type == 'char':
             fontname = self.get_fontname_from_node(node)
             width, height = TextShaper.measure(node.value, fontname=fontname)[0]
-            layout_tree = {'type': 'char', 'fixed': True, 'node': node, 'parent': parent, 'children': [], 'x': 0, 'y': 0, 'width': width, 'height': height, 'fontname': fontname}
+            layout_tree = Box('char', True, node, parent, width, height, fontname)
             self.current_node_layouts[node] = layout_tree
             return layout_tree
 
-        layout_tree = {'type': None,
-                       'fixed': False,
-                       'node': node,
-                       'parent': parent,
-                       'children': [],
-                       'x': 0,
-                       'y': 0,
-                       'width': 0,
-                       'height': 0,
-                       'fontname': None}
+        layout_tree = Box(None, False, node, parent)
 
         if node.type == 'eol':
-            layout_tree['type'] = 'eol'
-            layout_tree['fixed'] = True
-            layout_tree['fontname'] = self.get_fontname_from_node(node)
-            layout_tree['width'] = 1
-            width, height = TextShaper.measure_single('\n', fontname=layout_tree['fontname'])
-            layout_tree['height'] = height
+            layout_tree.type = 'eol'
+            layout_tree.fixed = True
+            layout_tree.fontname = self.get_fontname_from_node(node)
+            layout_tree.width = 1
+            width, height = TextShaper.measure_single('\n', fontname=layout_tree.fontname)
+            layout_tree.height = height
             self.current_node_layouts[node] = layout_tree
         elif node.type == 'end':
-            layout_tree['type'] = 'end'
-            layout_tree['fixed'] = True
-            layout_tree['fontname'] = self.get_fontname_from_node(node)
-            layout_tree['width'] = 1
-            width, height = TextShaper.measure_single('\n', fontname=layout_tree['fontname'])
-            layout_tree['height'] = height
+            layout_tree.type = 'end'
+            layout_tree.fixed = True
+            layout_tree.fontname = self.get_fontname_from_node(node)
+            layout_tree.width = 1
+            width, height = TextShaper.measure_single('\n', fontname=layout_tree.fontname)
+            layout_tree.height = height
             self.current_node_layouts[node] = layout_tree
         elif node.type == 'placeholder':
-            layout_tree['type'] = 'placeholder'
-            layout_tree['fixed'] = True
-            layout_tree['fontname'] = self.get_fontname_from_node(node)
-            width, height = TextShaper.measure_single('▯', fontname=layout_tree['fontname'])
-            layout_tree['width'] = width
-            layout_tree['height'] = height
+            layout_tree.type = 'placeholder'
+            layout_tree.fixed = True
+            layout_tree.fontname = self.get_fontname_from_node(node)
+            width, height = TextShaper.measure_single('▯', fontname=layout_tree.fontname)
+            layout_tree.width = width
+            layout_tree.height = height
             self.current_node_layouts[node] = layout_tree
         elif node.type == 'widget':
-            layout_tree['type'] = 'widget'
-            layout_tree['fixed'] = True
-            layout_tree['fontname'] = self.get_fontname_from_node(node)
+            layout_tree.type = 'widget'
+            layout_tree.fixed = True
+            layout_tree.fontname = self.get_fontname_from_node(node)
             self.current_node_layouts[node] = layout_tree
-            width, height = layout_tree['node'].value.get_allocation(layout_tree['fontname'])
-            layout_tree['width'] = width
-            layout_tree['height'] = height
+            width, height = layout_tree.node.value.get_allocation(layout_tree.fontname)
+            layout_tree.width = width
+            layout_tree.height = height
         elif node.type == 'mathscript':
-            layout_tree['type'] = 'mathscript'
-            layout_tree['fixed'] = False
-            layout_tree['fontname'] = self.get_fontname_from_node(node)
+            layout_tree.type = 'mathscript'
+            layout_tree.fixed = False
+            layout_tree.fontname = self.get_fontname_from_node(node)
             self.current_node_layouts[node] = layout_tree
         elif node.type == 'mathfraction':
-            layout_tree['type'] = 'mathfraction'
-            layout_tree['fixed'] = False
-            layout_tree['fontname'] = self.get_fontname_from_node(node)
+            layout_tree.type = 'mathfraction'
+            layout_tree.fixed = False
+            layout_tree.fontname = self.get_fontname_from_node(node)
             self.current_node_layouts[node] = layout_tree
         elif node.type == 'mathroot':
-            layout_tree['type'] = 'mathroot'
-            layout_tree['fixed'] = False
-            layout_tree['fontname'] = self.get_fontname_from_node(node)
+            layout_tree.type = 'mathroot'
+            layout_tree.fixed = False
+            layout_tree.fontname = self.get_fontname_from_node(node)
             self.current_node_layouts[node] = layout_tree
         elif node.type == 'mathlist':
-            layout_tree['type'] = 'hbox'
-            layout_tree['fixed'] = False
-            layout_tree['fontname'] = self.get_fontname_from_node(node)
+            layout_tree.type = 'hbox'
+            layout_tree.fixed = False
+            layout_tree.fontname = self.get_fontname_from_node(node)
         else:
             return None
 
         for child in node:
             subtree = self.make_layout_tree(child, layout_tree)
             if subtree != None:
-                layout_tree['children'].append(subtree)
+                layout_tree.children.append(subtree)
 
         return layout_tree
 
     def add_preedit(self, layout_tree, insert, preedit_string):
-        for i, child in enumerate(layout_tree['children']):
-            if child['node'] == insert:
-                fontname = self.get_fontname_from_node(child['node'])
+        for i, child in enumerate(layout_tree.children):
+            if child.node == insert:
+                fontname = self.get_fontname_from_node(child.node)
 
                 width, height = TextShaper.measure(preedit_string, fontname=fontname)[0]
-                layout_tree['children'].insert(i, {'type': 'preedit', 'fixed': False, 'node': child['node'], 'parent': layout_tree, 'children': [], 'x': 0, 'y': 0, 'width': width, 'height': height, 'fontname': fontname})
+                layout_tree.children.insert(i, Box('preedit', False, child.node, layout_tree, width, height, fontname))
                 break
 
             self.add_preedit(child, insert, preedit_string)
@@ -336,218 +471,266 @@ class Layout(object):
         return result
 
     def layout_tree(self, layout_tree):
-        if layout_tree['type'] == 'word': self.layout_word(layout_tree)
-        elif layout_tree['type'] == 'hbox': self.layout_hbox(layout_tree)
-        elif layout_tree['type'] == 'vbox': self.layout_vbox(layout_tree)
-        elif layout_tree['type'] == 'mathscript': self.layout_mathscript(layout_tree)
-        elif layout_tree['type'] == 'mathfraction': self.layout_mathfraction(layout_tree)
-        elif layout_tree['type'] == 'mathroot': self.layout_mathroot(layout_tree)
+        if layout_tree.type == 'word': self.layout_word(layout_tree)
+        elif layout_tree.type == 'hbox': self.layout_hbox(layout_tree)
+        elif layout_tree.type == 'vbox': self.layout_vbox(layout_tree)
+        elif layout_tree.type == 'mathscript': self.layout_mathscript(layout_tree)
+        elif layout_tree.type == 'mathfraction': self.layout_mathfraction(layout_tree)
+        elif layout_tree.type == 'mathroot': self.layout_mathroot(layout_tree)
 
     def layout_word(self, layout_tree):
-        layout_tree['width'] = 0
-        layout_tree['height'] = 0
-        for child in layout_tree['children']:
-            child['x'] = layout_tree['width']
+        layout_tree.width = 0
+        layout_tree.height = 0
+        for child in layout_tree.children:
+            child.x = layout_tree.width
 
-            layout_tree['width'] += child['width']
-            layout_tree['height'] = max(layout_tree['height'], child['height'])
+            layout_tree.width += child.width
+            layout_tree.height = max(layout_tree.height, child.height)
 
     @timer.timer
     def layout_paragraph(self, layout_tree, layout_width, indentation):
-        for child in layout_tree['children']:
-            if not child['fixed']:
+        for child in layout_tree.children:
+            if not child.fixed:
                 self.layout_tree(child)
 
         lines = list()
-        current_line = {'type': 'hbox', 'fixed': False, 'node': None, 'parent': layout_tree, 'children': [], 'x': 0, 'y': 0, 'width': 0, 'height': 0, 'fontname': None}
-        current_line_width = 0
-        for child in layout_tree['children']:
-            if child['type'] == 'eol' or child['type'] == 'end':
-                current_line['children'].append(child)
-                child['parent'] = current_line
-            else:
-                break_after_char = (child['type'] == 'char' and NodeTypeDB.is_whitespace(child['node']))
-                if break_after_char:
-                    current_line['children'].append(child)
-                    child['parent'] = current_line
-                    current_line_width += child['width']
-                    if current_line_width > 0 and child['width'] + current_line_width > layout_width:
-                        lines.append(current_line)
-                        current_line = {'type': 'hbox', 'fixed': False, 'node': None, 'parent': layout_tree, 'children': [], 'x': 0, 'y': 0, 'width': 0, 'height': 0, 'fontname': None}
-                        current_line_width = 0
-                else:
-                    if current_line_width > 0 and child['width'] + current_line_width > layout_width:
-                        lines.append(current_line)
-                        current_line = {'type': 'hbox', 'fixed': False, 'node': None, 'parent': layout_tree, 'children': [], 'x': 0, 'y': 0, 'width': 0, 'height': 0, 'fontname': None}
-                        current_line_width = 0
-                    current_line['children'].append(child)
-                    child['parent'] = current_line
-                    current_line_width += child['width']
-        lines.append(current_line)
-
-        layout_tree['height'] = 0
+        line_starts = [0] + self.get_line_breaks(layout_tree.children, layout_width)
+        line_ends = line_starts[1:] + [len(layout_tree.children)]
+        for start, end in zip(line_starts, line_ends):
+            line = Box('hbox', False, None, layout_tree)
+            line.children = layout_tree.children[start:end]
+            for child in line.children:
+                child.parent = line
+            lines.append(line)
+
+        layout_tree.height = 0
         for line in lines:
             self.layout_hbox(line)
-            line['x'] = indentation
-            line['y'] = layout_tree['height']
-            layout_tree['height'] += line['height']
-        layout_tree['children'] = lines
-        layout_tree['width'] = layout_width
-        layout_tree['x'] = 0
-        layout_tree['y'] = 0
+            line.x = indentation
+            line.y = layout_tree.height
+            layout_tree.height += line.height
+        layout_tree.children = lines
+        layout_tree.width = layout_width
+        layout_tree.x = 0
+
+    # Greedy line breaking: a line breaks before a box that would make it
+    # wider than layout_width, or after a whitespace char if the line plus
+    # its width again is too wide. eol and end take up no width and never
+    # break. With offsets the running sum of the widths, the first box that
+    # ends past the limit is found by bisection. Whitespace that breaks
+    # earlier can only be within the widest char before it, so only those
+    # boxes are looked at one by one.
+    # This relies on the widths being integers: the width of a line is taken
+    # as the difference of two offsets, which for other widths can round
+    # differently from summing the widths of the line. Those are left to
+    # get_line_breaks_by_line_sums.
+    def get_line_breaks(self, children, layout_width):
+        widths = [0 if child.type == 'eol' or child.type == 'end' else child.width for child in children]
+        if not isinstance(sum(widths), int):
+            return self.get_line_breaks_by_line_sums(children, layout_width)
+        offsets = list(itertools.accumulate(widths, initial=0))
+        max_char_width = max((child.width for child in children if child.type == 'char'), default=0)
+
+        breaks = list()
+        line_start = 0
+        index = 0
+        while index < len(children):
+            limit = offsets[line_start] + layout_width
+            end = bisect.bisect_right(offsets, limit, index + 1) - 1
+            start = max(index, bisect.bisect_right(offsets, limit - max_char_width, index + 1) - 1)
+            for i in range(start, end):
+                child = children[i]
+                if child.type == 'char' and NodeTypeDB.is_whitespace(child.node) and offsets[i + 1] + widths[i] > limit:
+                    end = i
+                    break
+            if end == len(children): break
+
+            child = children[end]
+            if child.type == 'eol' or child.type == 'end':
+                pass
+            elif child.type == 'char' and NodeTypeDB.is_whitespace(child.node):
+                if offsets[end + 1] > offsets[line_start]:
+                    line_start = end + 1
+                    breaks.append(line_start)
+            elif offsets[end] > offsets[line_start]:
+                line_start = end
+                breaks.append(line_start)
+                continue
+            index = end + 1
+        return breaks
+
+    # the same breaks, summing up the widths of each line box by box.
+    def get_line_breaks_by_line_sums(self, children, layout_width):
+        breaks = list()
+        current_line_width = 0
+        for index, child in enumerate(children):
+            if child.type == 'eol' or child.type == 'end':
+                continue
+
+            if child.type == 'char' and NodeTypeDB.is_whitespace(child.node):
+                current_line_width += child.width
+                if current_line_width > 0 and child.width + current_line_width > layout_width:
+                    breaks.append(index + 1)
+                    current_line_width = 0
+            else:
+                if current_line_width > 0 and child.width + current_line_width > layout_width:
+                    breaks.append(index)
+                    current_line_width = 0
+                current_line_width += child.width
+        return breaks
 
     def layout_vbox(self, layout_tree):
-        for child in layout_tree['children']:
-            if not child['fixed']:
+        for child in layout_tree.children:
+            if not child.fixed:
                 self.layout_tree(child)
 
-        layout_tree['width'] = 0
-        layout_tree['height'] = 0
-        for child in layout_tree['children']:
-            child['x'] = 0
-            child['y'] = layout_tree['height']
+        layout_tree.width = 0
+        layout_tree.height = 0
+        for child in layout_tree.children:
+            child.x = 0
+            child.y = layout_tree.height
 
-            layout_tree['height'] += child['height']
-            layout_tree['width'] = max(layout_tree['width'], child['width'])
+            layout_tree.height += child.height
+            layout_tree.width = max(layout_tree.width, child.width)
 
-        layout_tree['x'] = None
-        layout_tree['y'] = None
+        layout_tree.x = None
+        layout_tree.y = None
 
     def layout_hbox(self, layout_tree):
         new_children = []
-        for child in layout_tree['children']:
-            if child['type'] == 'word':
-                for word_child in child['children']:
-                    word_child['parent'] = layout_tree
+        for child in layout_tree.children:
+            if child.type == 'word':
+                for word_child in child.children:
+                    word_child.parent = layout_tree
                     new_children.append(word_child)
             else:
                 new_children.append(child)
-        layout_tree['children'] = new_children
+        layout_tree.children = new_children
 
-        for child in layout_tree['children']:
-            if not child['fixed']:
+        descends_by_fontname = dict()
+        descends = list()
+        for child in layout_tree.children:
+            if not child.fixed:
                 self.layout_tree(child)
+            if child.fontname not in descends_by_fontname:
+                descends_by_fontname[child.fontname] = TextShaper.get_descend(fontname=child.fontname)
+            descends.append(descends_by_fontname[child.fontname])
+        min_descend = min(0, min(descends_by_fontname.values(), default=0))
 
-        min_descend = 0
-        for child in layout_tree['children']:
-            min_descend = min(min_descend, TextShaper.get_descend(fontname=child['fontname']))
-
-        for child in layout_tree['children']:
-            child['height'] -= min_descend - TextShaper.get_descend(fontname=child['fontname'])
+        layout_tree.width = 0
+        layout_tree.height = 0
+        for child, descend in zip(layout_tree.children, descends):
+            child.height -= min_descend - descend
+            child.x = layout_tree.width
 
-        layout_tree['width'] = 0
-        layout_tree['height'] = 0
-        for child in layout_tree['children']:
-            child['x'] = layout_tree['width']
+            layout_tree.width += child.width
+            layout_tree.height = max(layout_tree.height, child.height - min_descend + descend)
 
-            layout_tree['width'] += child['width']
-            layout_tree['height'] = max(layout_tree['height'], child['height'] - min_descend + TextShaper.get_descend(fontname=child['fontname']))
-
-        for child in layout_tree['children']:
-            child['y'] = layout_tree['height'] - child['height']
+        for child in layout_tree.children:
+            child.y = layout_tree.height - child.height
 
     def layout_mathscript(self, layout_tree):
-        if len(layout_tree['children']) == 2:
-            for child in layout_tree['children']:
-                if not child['fixed']:
+        if len(layout_tree.children) == 2:
+            for child in layout_tree.children:
+                if not child.fixed:
                     self.layout_tree(child)
 
-            vbox = {'type': 'vbox', 'fixed': False, 'node': None, 'parent': layout_tree, 'children': [], 'x': 0, 'y': 0, 'width': 0, 'height': 0, 'fontname': None}
+            vbox = Box('vbox', False, None, layout_tree)
             height = 0
-            for child in layout_tree['children']:
-                child['parent'] = vbox
-                child['x'] = 0
-                child['y'] = height
-                height += child['height']
-                vbox['children'].insert(0, child)
+            for child in layout_tree.children:
+                child.parent = vbox
+                child.x = 0
+                child.y = height
+                height += child.height
+                vbox.children.insert(0, child)
 
-            layout_tree['children'] = [vbox]
+            layout_tree.children = [vbox]
 
-        for child in layout_tree['children']:
-            if not child['fixed']:
+        for child in layout_tree.children:
+            if not child.fixed:
                 self.layout_tree(child)
 
-        if layout_tree['children'][0]['children'][0]['height'] == 0:
-            layout_tree['children'][0]['children'][0]['height'] = layout_tree['children'][0]['children'][1]['height']
-            layout_tree['children'][0]['children'][1]['y'] = layout_tree['children'][0]['children'][1]['height']
-            layout_tree['children'][0]['height'] += layout_tree['children'][0]['children'][0]['height']
+        if layout_tree.children[0].children[0].height == 0:
+            layout_tree.children[0].children[0].height = layout_tree.children[0].children[1].height
+            layout_tree.children[0].children[1].y = layout_tree.children[0].children[1].height
+            layout_tree.children[0].height += layout_tree.children[0].children[0].height
 
-        if layout_tree['children'][0]['children'][1]['height'] == 0:
-            layout_tree['children'][0]['children'][1]['height'] = layout_tree['children'][0]['children'][0]['height']
-            layout_tree['children'][0]['height'] += layout_tree['children'][0]['children'][1]['height']
+        if layout_tree.children[0].children[1].height == 0:
+            layout_tree.children[0].children[1].height = layout_tree.children[0].children[0].height
+            layout_tree.children[0].height += layout_tree.children[0].children[1].height
 
-        fontname = self.get_fontname_from_node(layout_tree['node'])
+        fontname = self.get_fontname_from_node(layout_tree.node)
         extents = TextShaper.measure_single(' ', fontname=fontname)
 
-        layout_tree['children'][0]['x'] = 1
-        layout_tree['children'][0]['y'] = extents[1] / 2 - layout_tree['children'][0]['height'] / 2
+        layout_tree.children[0].x = 1
+        layout_tree.children[0].y = extents[1] / 2 - layout_tree.children[0].height / 2
 
-        layout_tree['width'] = layout_tree['children'][0]['width'] + 1
-        layout_tree['height'] = layout_tree['children'][0]['height']
-        layout_tree['x'] = None
-        layout_tree['y'] = None
+        layout_tree.width = layout_tree.children[0].width + 1
+        layout_tree.height = layout_tree.children[0].height
+        layout_tree.x = None
+        layout_tree.y = None
 
     def layout_mathfraction(self, layout_tree):
-        if len(layout_tree['children']) == 2:
-            for child in layout_tree['children']:
-                if not child['fixed']:
+        if len(layout_tree.children) == 2:
+            for child in layout_tree.children:
+                if not child.fixed:
                     self.layout_tree(child)
 
-            vbox = {'type': 'vbox', 'fixed': False, 'node': None, 'parent': layout_tree, 'children': [], 'x': 0, 'y': 0, 'width': 0, 'height': 0, 'fontname': None}
+            vbox = Box('vbox', False, None, layout_tree)
             height = 0
-            for child in layout_tree['children']:
-                child['parent'] = vbox
-                child['x'] = 0
-                child['y'] = height
-                height += child['height']
-                vbox['children'].append(child)
+            for child in layout_tree.children:
+                child.parent = vbox
+                child.x = 0
+                child.y = height
+                height += child.height
+                vbox.children.append(child)
 
-            layout_tree['children'] = [vbox]
+            layout_tree.children = [vbox]
 
-        for child in layout_tree['children']:
-            if not child['fixed']:
+        for child in layout_tree.children:
+            if not child.fixed:
                 self.layout_tree(child)
 
         # centering
-        if layout_tree['children'][0]['children'][0]['width'] < layout_tree['children'][0]['children'][1]['width']:
-            min_child = layout_tree['children'][0]['children'][0]
-            padding = (layout_tree['children'][0]['width'] - layout_tree['children'][0]['children'][0]['width']) / 2
+        if layout_tree.children[0].children[0].width < layout_tree.children[0].children[1].width:
+            min_child = layout_tree.children[0].children[0]
+            padding = (layout_tree.children[0].width - layout_tree.children[0].children[0].width) / 2
         else:
-            min_child = layout_tree['children'][0]['children'][1]
-            padding = (layout_tree['children'][0]['width'] - layout_tree['children'][0]['children'][1]['width']) / 2
-        for child in min_child['children']:
-            child['x'] += padding
-        layout_tree['children'][0]['children'][0]['width'] = layout_tree['children'][0]['width']
-        layout_tree['children'][0]['children'][1]['width'] = layout_tree['children'][0]['width']
+            min_child = layout_tree.children[0].children[1]
+            padding = (layout_tree.children[0].width - layout_tree.children[0].children[1].width) / 2
+        for child in min_child.children:
+            child.x += padding
+        layout_tree.children[0].children[0].width = layout_tree.children[0].width
+        layout_tree.children[0].children[1].width = layout_tree.children[0].width
 
-        for child in layout_tree['children'][0]['children'][1]['children']:
-            child['y'] += 2
+        for child in layout_tree.children[0].children[1].children:
+            child.y += 2
 
-        fontname = self.get_fontname_from_node(layout_tree['node'])
+        fontname = self.get_fontname_from_node(layout_tree.node)
         extents = TextShaper.measure_single(' ', fontname=fontname)
 
-        layout_tree['children'][0]['x'] = 1
-        layout_tree['children'][0]['y'] = extents[1] / 2 - layout_tree['children'][0]['height'] / 2
+        layout_tree.children[0].x = 1
+        layout_tree.children[0].y = extents[1] / 2 - layout_tree.children[0].height / 2
 
-        layout_tree['width'] = layout_tree['children'][0]['width'] + 2
-        layout_tree['height'] = layout_tree['children'][0]['height']
-        layout_tree['x'] = None
-        layout_tree['y'] = None
+        layout_tree.width = layout_tree.children[0].width + 2
+        layout_tree.height = layout_tree.children[0].height
+        layout_tree.x = None
+        layout_tree.y = None
 
     def layout_mathroot(self, layout_tree):
-        for child in layout_tree['children']:
-            if not child['fixed']:
+        for child in layout_tree.children:
+            if not child.fixed:
                 self.layout_tree(child)
 
-        layout_tree['children'][0]['x'] = max(7, layout_tree['children'][1]['width']) + 10
-        layout_tree['children'][0]['y'] = 0
-        layout_tree['children'][1]['x'] = 1
-        layout_tree['children'][1]['y'] = layout_tree['children'][0]['height'] - 13 - layout_tree['children'][1]['height']
+        layout_tree.children[0].x = max(7, layout_tree.children[1].width) + 10
+        layout_tree.children[0].y = 0
+        layout_tree.children[1].x = 1
+        layout_tree.children[1].y = layout_tree.children[0].height - 13 - layout_tree.children[1].height
 
-        layout_tree['width'] = layout_tree['children'][0]['width'] + max(7, layout_tree['children'][1]['width']) + 10
-        layout_tree['height'] = layout_tree['children'][0]['height']
-        layout_tree['x'] = None
-        layout_tree['y'] = None
+        layout_tree.width = layout_tree.children[0].width + max(7, layout_tree.children[1].width) + 10
+        layout_tree.height = layout_tree.children[0].height
+        layout_tree.x = None
+        layout_tree.y = None
 
     def get_fontname_from_node(self, node=None):
         if NodeTypeDB.is_subscript(node) or NodeTypeDB.is_superscript(node):
@@ -573,3 +756,53 @@ class Layout(object):
         return 'body'
 
 
+# Nodes of the layout trees. There are lots of them, so they use slots
+# instead of a dict per node. Item access is kept for code that still reads
+# them like dicts.
+class Box(object):
+
+    __slots__ = ('type', 'fixed', 'node', 'parent', 'children', 'x', 'y', 'width', 'height', 'fontname')
+
+    def __init__(self, type, fixed, node, parent, width=0, height=0, fontname=None):
+        self.type = type
+        self.fixed = fixed
+        self.node = node
+        self.parent = parent
+        self.children = []
+        self.x = 0
+        self.y = 0
+        self.width = width
+        self.height = height
+        self.fontname = fontname
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+
+# Paragraph boxes don't store their y offset, which changes whenever a
+# paragraph above changes its height. It is computed from the paragraph
+# heights when it's read instead.
+class ParagraphBox(Box):
+
+    __slots__ = ('layout',)
+
+    def __init__(self, layout, paragraph):
+        self.type = 'paragraph'
+        self.fixed = False
+        self.node = paragraph
+        self.parent = None
+        self.children = []
+        self.x = 0
+        self.width = 0
+        self.height = 0
+        self.fontname = None
+        self.layout = layout
+
+    @property
+    def y(self):
+        return self.layout.get_paragraph_y(self.node)
+
+
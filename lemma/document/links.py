@@ -18,28 +18,69 @@
 import lemma.services.timer as timer
 
 
+# The number of paragraphs linking to each target is counted, so only the
+# paragraphs that changed have to be looked at. The set of links is replaced,
+# never changed in place, as it is handed out to the document stubs.
 class Links(object):
 
     def __init__(self, document):
         self.document = document
 
         self.paragraph_links = dict()
+        self.link_counts = dict()
         self.links = set()
-
-    def invalidate_paragraph(self, paragraph):
-        if paragraph in self.paragraph_links:
-            del(self.paragraph_links[paragraph])
+        self.revision = None
+        self.ast_version = None
 
     @timer.timer
     def update(self):
-        self.links = set()
+        if self.revision == self.document.revision: return
+
+        added_or_removed = set()
+        paragraphs = self.document.get_paragraphs_changed_since(self.revision, self.ast_version)
+        if paragraphs == None:
+            paragraphs = self.document.ast
+            current_paragraphs = set(paragraphs)
+            for paragraph in [paragraph for paragraph in self.paragraph_links if paragraph not in current_paragraphs]:
+                added_or_removed |= self.remove_links(self.paragraph_links[paragraph][1])
+                del(self.paragraph_links[paragraph])
+            for paragraph in current_paragraphs:
+                if paragraph not in self.paragraph_links:
+                    self.paragraph_links[paragraph] = (None, set())
 
-        for paragraph in self.document.ast:
-            if paragraph not in self.paragraph_links:
-                self.paragraph_links[paragraph] = set()
+        for paragraph in paragraphs:
+            if paragraph in self.paragraph_links and self.paragraph_links[paragraph][0] != paragraph.version:
+                links = set()
                 for node in paragraph:
                     if node.link != None and node.type == 'char':
-                        self.paragraph_links[paragraph].add(node.link)
-            self.links |= self.paragraph_links[paragraph]
+                        links.add(node.link)
+                added_or_removed |= self.remove_links(self.paragraph_links[paragraph][1])
+                added_or_removed |= self.add_links(links)
+                self.paragraph_links[paragraph] = (paragraph.version, links)
+
+        # a paragraph keeping its links removes and adds them again, so
+        # the set is only replaced if a link really appeared or disappeared.
+        if any((link in self.link_counts) != (link in self.links) for link in added_or_removed):
+            self.links = set(self.link_counts)
+        self.revision = self.document.revision
+        self.ast_version = self.document.get_ast_version()
+
+    def add_links(self, links):
+        added = set()
+        for link in links:
+            if link not in self.link_counts:
+                self.link_counts[link] = 0
+                added.add(link)
+            self.link_counts[link] += 1
+        return added
+
+    def remove_links(self, links):
+        removed = set()
+        for link in links:
+            self.link_counts[link] -= 1
+            if self.link_counts[link] == 0:
+                del(self.link_counts[link])
+                removed.add(link)
+        return removed
 
 
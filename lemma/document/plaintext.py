@@ -19,6 +19,8 @@ from lemma.services.node_type_db import NodeTypeDB
 import lemma.services.timer as timer
 
 
+# The plaintext is kept in one piece per paragraph, which are only joined
+# when the whole text is read after a paragraph changed.
 class Plaintext(object):
 
     def __init__(self, document):
@@ -26,17 +28,21 @@ class Plaintext(object):
 
         self.paragraph_plaintexts = dict()
         self.plaintext = ''
-
-    def invalidate_paragraph(self, paragraph):
-        if paragraph in self.paragraph_plaintexts:
-            del(self.paragraph_plaintexts[paragraph])
+        self.revision = None
+        self.ast_version = None
 
     @timer.timer
     def update(self):
-        self.plaintext = ''
+        if self.revision == self.document.revision: return
+
+        paragraphs = self.document.get_paragraphs_changed_since(self.revision, self.ast_version)
+        if paragraphs == None:
+            paragraphs = self.document.ast
+            self.paragraph_plaintexts = {paragraph: self.paragraph_plaintexts.get(paragraph, (None, '')) for paragraph in paragraphs}
+            self.plaintext = None
 
-        for paragraph in self.document.ast:
-            if paragraph not in self.paragraph_plaintexts:
+        for paragraph in paragraphs:
+            if paragraph in self.paragraph_plaintexts and self.paragraph_plaintexts[paragraph][0] != paragraph.version:
                 text = ''
                 for node in paragraph:
                     if node.type == 'char':
@@ -45,7 +51,16 @@ class Plaintext(object):
                         text += '\n'
                     elif node.type == 'widget':
                         text += node.value.to_plaintext()
-                self.paragraph_plaintexts[paragraph] = text
-            self.plaintext += self.paragraph_plaintexts[paragraph]
+                self.paragraph_plaintexts[paragraph] = (paragraph.version, text)
+                self.plaintext = None
+
+        self.revision = self.document.revision
+        self.ast_version = self.document.get_ast_version()
+
+    def get_plaintext(self):
+        self.update()
+        if self.plaintext == None:
+            self.plaintext = ''.join(text for version, text in self.paragraph_plaintexts.values())
+        return self.plaintext
 
 
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+
+from lemma.services.xml_exporter import XMLExporter
+import lemma.services.timer as timer
+
+
+# A snapshot is a frozen version of a document, which can be read on other
+# threads, or pickled and sent to other processes, while editing continues.
+# Paragraphs that didn't change are represented by the same ParagraphSnapshot
+# in consecutive snapshots, so taking one only costs work for the paragraphs
+# that were edited in between.
+class Snapshots(object):
+
+    def __init__(self, document):
+        self.document = document
+
+        self.paragraph_snapshots = dict()
+        self.paragraphs = tuple()
+        self.snapshot = None
+        self.revision = None
+        self.ast_version = None
+
+    # the head changes with the cursor alone, a new snapshot for it reuses
+    # the paragraphs of the last one.
+    @timer.timer
+    def update(self):
+        document = self.document
+        document.xml.update()
+        if self.revision != document.revision:
+            self.update_paragraphs()
+
+        head = document.xml.snapshot[0]
+        if self.snapshot == None or self.snapshot.head != head or self.snapshot.paragraphs is not self.paragraphs:
+            self.snapshot = DocumentSnapshot(document.id, document.revision, document.last_modified, document.title, head, self.paragraphs, document.links.links, document.files.files)
+
+    def update_paragraphs(self):
+        document = self.document
+        document.plaintext.update()
+        document.links.update()
+        document.files.update()
+
+        paragraphs = document.get_paragraphs_changed_since(self.revision, self.ast_version)
+        if paragraphs == None:
+            paragraphs = document.ast
+            self.paragraph_snapshots = {paragraph: self.paragraph_snapshots.get(paragraph) for paragraph in paragraphs}
+
+        for paragraph in paragraphs:
+            if paragraph in self.paragraph_snapshots:
+                paragraph_snapshot = self.paragraph_snapshots[paragraph]
+                if paragraph_snapshot == None or paragraph_snapshot.version != paragraph.version:
+                    self.paragraph_snapshots[paragraph] = self.make_paragraph_snapshot(paragraph)
+
+        self.paragraphs = tuple(self.paragraph_snapshots.values())
+        self.revision = document.revision
+        self.ast_version = document.get_ast_version()
+
+    def make_paragraph_snapshot(self, paragraph):
+        document = self.document
+        return ParagraphSnapshot(paragraph.version, document.xml.paragraph_xml[paragraph][1], document.plaintext.paragraph_plaintexts[paragraph][1], document.links.paragraph_links[paragraph][1], document.files.paragraph_files[paragraph][1])
+
+
+class DocumentSnapshot(object):
+
+    __slots__ = ('id', 'revision', 'last_modified', 'title', 'head', 'paragraphs', 'links', 'files')
+
+    def __init__(self, id, revision, last_modified, title, head, paragraphs, links, files):
+        self.id = id
+        self.revision = revision
+        self.last_modified = last_modified
+        self.title = title
+        self.head = head
+        self.paragraphs = paragraphs
+        self.links = links
+        self.files = files
+
+    def get_paragraph_xmls(self):
+        return [paragraph.xml for paragraph in self.paragraphs]
+
+    def get_xml(self):
+        return XMLExporter.join_document(self.head, self.get_paragraph_xmls())
+
+    def get_plaintext(self):
+        return ''.join(paragraph.plaintext for paragraph in self.paragraphs)
+
+    def get_stub(self):
+        return {'id': self.id, 'last_modified': self.last_modified, 'title': self.title, 'plaintext': self.get_plaintext(), 'links': self.links, 'files': self.files}
+
+
+class ParagraphSnapshot(object):
+
+    __slots__ = ('version', 'xml', 'plaintext', 'links', 'files')
+
+    def __init__(self, version, xml, plaintext, links, files):
+        self.version = version
+        self.xml = xml
+        self.plaintext = plaintext
+        self.links = links
+        self.files = files
+
+
@@ -16,6 +16,7 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 
 from lemma.services.xml_exporter import XMLExporter
+import lemma.services.xml_helpers as xml_helpers
 import lemma.services.timer as timer
 
 
@@ -25,15 +26,47 @@ class XML(object):
         self.document = document
 
         self.paragraph_xml = dict()
+        self.paragraph_xmls = tuple()
+        self.snapshot = None
+        self.xml = None
+        self.revision = None
+        self.ast_version = None
 
-    def invalidate_paragraph(self, paragraph):
-        if paragraph in self.paragraph_xml:
-            del(self.paragraph_xml[paragraph])
-
+    # the xml of each paragraph is a string and never changed in place, so the
+    # snapshot can be joined into the full document on another thread.
+    # the head holds the cursor, which can move without a new revision, so
+    # it is made again every time.
     @timer.timer
     def update(self):
-        for paragraph in self.document.ast:
-            if paragraph not in self.paragraph_xml:
-                self.paragraph_xml[paragraph] = XMLExporter.export_paragraph(paragraph.children, paragraph.style, paragraph.indentation_level, paragraph.state)
+        if self.revision != self.document.revision:
+            self.update_paragraphs()
+
+        head = self.get_head()
+        if self.snapshot == None or self.snapshot[0] != head or self.snapshot[1] is not self.paragraph_xmls:
+            self.snapshot = (head, self.paragraph_xmls)
+            self.xml = None
+
+    def update_paragraphs(self):
+        paragraphs = self.document.get_paragraphs_changed_since(self.revision, self.ast_version)
+        if paragraphs == None:
+            paragraphs = self.document.ast
+            self.paragraph_xml = {paragraph: self.paragraph_xml.get(paragraph, (None, '')) for paragraph in paragraphs}
+
+        for paragraph in paragraphs:
+            if paragraph in self.paragraph_xml and self.paragraph_xml[paragraph][0] != paragraph.version:
+                self.paragraph_xml[paragraph] = (paragraph.version, XMLExporter.export_paragraph(paragraph.children, paragraph.style, paragraph.indentation_level, paragraph.state))
+
+        self.paragraph_xmls = tuple(xml for version, xml in self.paragraph_xml.values())
+        self.revision = self.document.revision
+        self.ast_version = self.document.get_ast_version()
+
+    def get_head(self):
+        cursor_state = self.document.get_cursor_state()
+        head = '<head>'
+        head += '<title>' + xml_helpers.escape(self.document.title) + '</title>'
+        head += '<meta name="insert-position" content="' + str(cursor_state[0]) + '" />'
+        head += '<meta name="selection-position" content="' + str(cursor_state[1]) + '" />'
+        head += '</head>'
+        return head
 
 
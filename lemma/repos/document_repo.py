@@ -19,12 +19,20 @@ import gi
 gi.require_version('Gtk', '4.0')
 from gi.repository import GObject
 
-import os.path, os, pickle, time, threading
+import os.path, os, io, pickle, time, threading, queue, heapq, itertools
+import concurrent.futures, multiprocessing
 
 from lemma.document.document import Document
 from lemma.document.ast import Paragraph
 from lemma.services.xml_parser import XMLParser
+from lemma.services.xml_exporter import XMLExporter
+from lemma.services.stub_extractor import StubExtractor
 from lemma.services.files import Files
+from lemma.services.search_index import SearchIndex
+from lemma.services.message_bus import MessageBus
+from lemma.services.document_writer import DocumentWriter
+from lemma.services.document_records import DocumentRecords
+from lemma.services.settings import Settings
 import lemma.services.xml_helpers as xml_helpers
 import lemma.services.timer as timer
 
@@ -32,21 +40,205 @@ import lemma.services.timer as timer
 class DocumentRepo():
 
     document_stubs_by_id = dict()
+    outdated_documents_by_id = dict()
+    revisions_by_id = dict()
+    cursor_states_by_id = dict()
     max_document_id = 0
+    saving_delay = 5
+    max_saving_delay = 60
     saving_schedule = dict()
-    document_saving_lock = threading.Lock()
+    saving_queue = list()
+    stub_loader = None
+    loaded_stubs = queue.Queue()
+    pending_ids = set()
+    stubs_loaded_callbacks = list()
+    stub_store_records = 0
+    paragraph_ids_by_document_id = dict()
+    stored_records_by_document_id = dict()
+    stored_records_lock = threading.Lock()
+    max_records_per_document = 64
+    min_parallel_stub_count = 256
+    document_locks_by_pathname = dict()
+    document_locks_lock = threading.Lock()
     stub_saving_lock = threading.Lock()
 
     @timer.timer
-    def init():
+    def init(priority_ids=None):
         document_ids = list()
         for direntry in os.scandir(Files.get_documents_folder()):
             if direntry.is_file() and direntry.name.isdigit():
                 document_ids.append(int(direntry.name))
+            elif direntry.is_file() and direntry.name.endswith('.tmp'):
+                os.remove(direntry.path)
         DocumentRepo.max_document_id = max(document_ids + [0])
 
+        # stubs needed for the first frame are computed right away, all others are
+        # loaded in the background and merged in batches by merge_loaded_stubs.
+        priority_ids = set(priority_ids or []) & set(document_ids)
+        for document_id in priority_ids:
+            DocumentRepo.document_stubs_by_id[document_id] = DocumentRepo.compute_stub(document_id)
+
+        SearchIndex.add_stubs(DocumentRepo.document_stubs_by_id.values())
+
+        DocumentRepo.pending_ids = set(document_ids) - priority_ids
+        DocumentRepo.stub_loader = threading.Thread(target=DocumentRepo.load_stubs, args=(list(DocumentRepo.pending_ids),))
+        DocumentRepo.stub_loader.start()
+
+        DocumentWriter.init(DocumentRepo.write_batch_to_disk)
+
+        GObject.timeout_add(100, DocumentRepo.merge_loaded_stubs)
+        GObject.timeout_add(1000, DocumentRepo.lazy_save_loop)
+
+    @timer.timer
+    def load_stubs(document_ids):
+        pathname_store = os.path.join(Files.get_stubs_folder(), 'store')
+        if os.path.isfile(pathname_store):
+            records_by_id, is_migrated = DocumentRepo.load_stubs_from_store(pathname_store), False
+        else:
+            records_by_id, is_migrated = DocumentRepo.load_stubs_from_folder(document_ids), True
+            DocumentRepo.write_stubs_to_disk([pickle.dumps((document_id, file_mtime, stub)) for document_id, (file_mtime, stub) in records_by_id.items()])
+
+        # stubs are stored with the mtime of the document file they were made from.
+        # if the file changed since, for example by a sync from another machine,
+        # the stub is made again.
+        stubs_by_id = dict()
+        for document_id in document_ids:
+            if document_id in records_by_id:
+                file_mtime, stub = records_by_id[document_id]
+                try:
+                    if os.path.getmtime(os.path.join(Files.get_documents_folder(), str(document_id))) == file_mtime:
+                        stubs_by_id[document_id] = stub
+                except OSError: pass
+
+        # stubs are indexed for search before they are handed to the main thread
+        SearchIndex.load(stubs_by_id)
+        stubs = [stubs_by_id[document_id] for document_id in document_ids if document_id in stubs_by_id]
+        for i in range(0, len(stubs), 256):
+            SearchIndex.add_stubs(stubs[i:i + 256])
+            DocumentRepo.loaded_stubs.put(stubs[i:i + 256])
+
+        # computed stubs have the mtime of the document file as last_modified
+        outdated_ids = [document_id for document_id in document_ids if document_id not in stubs_by_id]
+        for stubs in DocumentRepo.compute_stubs(outdated_ids, 256):
+            for stub in stubs:
+                stubs_by_id[stub['id']] = stub
+            DocumentRepo.write_stubs_to_disk([pickle.dumps((stub['id'], stub['last_modified'], stub)) for stub in stubs])
+            SearchIndex.add_stubs(stubs)
+            DocumentRepo.loaded_stubs.put(stubs)
+
+        if is_migrated or DocumentRepo.stub_store_records > 2 * len(stubs_by_id):
+            DocumentRepo.compact_stub_store()
+
+    @timer.timer
+    def merge_loaded_stubs():
+        merged_stubs = list()
+        while not DocumentRepo.loaded_stubs.empty():
+            for stub in DocumentRepo.loaded_stubs.get():
+                if stub['id'] in DocumentRepo.pending_ids and stub['id'] not in DocumentRepo.document_stubs_by_id:
+                    DocumentRepo.document_stubs_by_id[stub['id']] = stub
+                    merged_stubs.append(stub)
+                DocumentRepo.pending_ids.discard(stub['id'])
+
+        if len(merged_stubs) > 0:
+            MessageBus.add_message('document_stubs_loaded')
+
+        is_loading = DocumentRepo.stub_loader.is_alive() or not DocumentRepo.loaded_stubs.empty()
+        if not is_loading:
+            # documents deleted while loading may have been indexed by the loader
+            DocumentRepo.pending_ids = set()
+            SearchIndex.remove_all_except(DocumentRepo.document_stubs_by_id)
+
+        if len(DocumentRepo.pending_ids) == 0:
+            callbacks, DocumentRepo.stubs_loaded_callbacks = DocumentRepo.stubs_loaded_callbacks, list()
+            for callback in callbacks:
+                callback()
+        return is_loading
+
+    def has_all_stubs():
+        return len(DocumentRepo.pending_ids) == 0
+
+    # for actions that need the stubs of all documents. they are run on the main
+    # loop once the stubs are loaded, instead of blocking it until then.
+    def call_when_all_stubs_loaded(callback):
+        if DocumentRepo.has_all_stubs():
+            callback()
+        else:
+            DocumentRepo.stubs_loaded_callbacks.append(callback)
+
+    def wait_for_stubs():
+        if DocumentRepo.stub_loader != None:
+            DocumentRepo.stub_loader.join()
+            DocumentRepo.merge_loaded_stubs()
+
+    # parsing is cpu bound, so large rebuilds are spread over one process per core.
+    # this runs on the stub loader thread while gtk and the writer threads are live,
+    # so the workers are spawned, not forked. they have to import the app first,
+    # which only pays off for many documents. stubs are yielded in batches, in order.
+    def compute_stubs(document_ids, batch_size):
+        cpu_count = os.cpu_count() or 1
+        if len(document_ids) < DocumentRepo.min_parallel_stub_count or cpu_count == 1:
+            for i in range(0, len(document_ids), batch_size):
+                yield [DocumentRepo.compute_stub(document_id) for document_id in document_ids[i:i + batch_size]]
+            return
+
+        chunksize = max(1, min(batch_size, len(document_ids) // (4 * cpu_count)))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=cpu_count, mp_context=multiprocessing.get_context('spawn')) as executor:
+            stubs = executor.map(DocumentRepo.compute_stub, document_ids, chunksize=chunksize)
+            for i in range(0, len(document_ids), batch_size):
+                yield list(itertools.islice(stubs, batch_size))
+
+    def compute_stub(document_id):
+        pathname = os.path.join(Files.get_documents_folder(), str(document_id))
+        last_modified = os.path.getmtime(pathname)
+
+        xml = DocumentRecords.read_xml(pathname)
+        title, plaintext, links, files = StubExtractor.extract(xml)
+
+        return {'id': document_id, 'last_modified': last_modified, 'title': title, 'plaintext': plaintext, 'links': links, 'files': files}
+
+    # a partly written last record can be left behind by a crash. it is cut off
+    # before the writers append to the store again.
+    @timer.timer
+    def load_stubs_from_store(pathname):
+        with DocumentRepo.stub_saving_lock:
+            records_by_id, record_count, end_of_records = DocumentRepo.read_stub_store(pathname)
+            if end_of_records < os.path.getsize(pathname):
+                os.truncate(pathname, end_of_records)
+            DocumentRepo.stub_store_records += record_count
+        return records_by_id
+
+    def read_stub_store(pathname):
+        records_by_id = dict()
+        record_count = 0
+        if not os.path.isfile(pathname): return records_by_id, record_count, 0
+
+        with open(pathname, 'rb') as file:
+            data = file.read()
+        records = io.BytesIO(data)
+        end_of_records = 0
+
+        while True:
+            try:
+                document_id, file_mtime, stub = pickle.load(records)
+            except (EOFError, pickle.UnpicklingError, ValueError): break
+            else:
+                end_of_records = records.tell()
+                record_count += 1
+                if stub != None:
+                    records_by_id[document_id] = (file_mtime, stub)
+                elif document_id in records_by_id:
+                    del(records_by_id[document_id])
+
+        return records_by_id, record_count, end_of_records
+
+    # migration from the stubs folder of versions with one pickle file per document.
+    # those stubs were written along with their document, so they are stored
+    # with the current mtime of the document file.
+    @timer.timer
+    def load_stubs_from_folder(document_ids):
+        records_by_id = dict()
+
         for document_id in document_ids:
-            pathname_document = os.path.join(Files.get_documents_folder(), str(document_id))
             pathname_stub = os.path.join(Files.get_stubs_folder(), str(document_id))
 
             if os.path.isfile(pathname_stub):
@@ -56,42 +248,45 @@ class DocumentRepo():
                     except EOFError: pass
                     else:
                         if os.path.getmtime(pathname_stub) >= stub['last_modified']:
-                            DocumentRepo.document_stubs_by_id[document_id] = stub
-
-            if document_id not in DocumentRepo.document_stubs_by_id:
-                document = Document(document_id)
-                document.last_modified = os.path.getmtime(pathname_document)
+                            file_mtime = os.path.getmtime(os.path.join(Files.get_documents_folder(), str(document_id)))
+                            records_by_id[document_id] = (file_mtime, stub)
 
-                with open(pathname_document, 'r') as file:
-                    xml = file.read()
+        return records_by_id
 
-                title, meta, paragraphs = XMLParser.parse(xml)
-                if paragraphs != None:
-                    for paragraph in paragraphs:
-                        if len(paragraph) > 0 and paragraph[-1].type == 'eol':
-                            document.ast.append(paragraph)
-                if len(document.ast) > 1:
-                    document.ast.remove(document.ast[0])
-
-                document.title = title
-                document.cursor.set_state([document.ast[0][0].get_position(), document.ast[0][0].get_position()])
-
-                stub = {'id': document_id, 'last_modified': document.last_modified, 'title': document.title, 'plaintext': document.get_plaintext(), 'links': document.get_links(), 'files': document.get_files()}
+    # the store is rewritten from its own records, keeping the last one of each
+    # document that still exists. the stubs of the main thread aren't read, so
+    # this can run on the stub loader thread. writers wait for it to finish.
+    @timer.timer
+    def compact_stub_store():
+        pathname = os.path.join(Files.get_stubs_folder(), 'store')
 
-                DocumentRepo.document_stubs_by_id[document_id] = stub
-                with open(pathname_stub, 'wb') as filehandle:
-                    pickle.dump(stub, filehandle)
+        DocumentRepo.stub_saving_lock.acquire()
+        records_by_id, record_count, end_of_records = DocumentRepo.read_stub_store(pathname)
+        records_by_id = {document_id: record for document_id, record in records_by_id.items() if os.path.isfile(os.path.join(Files.get_documents_folder(), str(document_id)))}
+        with open(pathname + '.tmp', 'wb') as filehandle:
+            for document_id, (file_mtime, stub) in records_by_id.items():
+                filehandle.write(pickle.dumps((document_id, file_mtime, stub)))
+        os.replace(pathname + '.tmp', pathname)
+        DocumentRepo.stub_store_records = len(records_by_id)
+        DocumentRepo.stub_saving_lock.release()
 
-        GObject.timeout_add(1000, DocumentRepo.lazy_save_loop)
+        for direntry in os.scandir(Files.get_stubs_folder()):
+            if direntry.is_file() and direntry.name.isdigit():
+                os.remove(os.path.join(Files.get_stubs_folder(), direntry.name))
 
     @timer.timer
     def wrap_up():
+        DocumentRepo.wait_for_stubs()
+
         for document_id in list(DocumentRepo.saving_schedule):
             document = DocumentRepo.saving_schedule[document_id][0]
             del(DocumentRepo.saving_schedule[document_id])
 
-            DocumentRepo.save_document(document, can_wait=False)
+            DocumentRepo.schedule_write(document)
+        DocumentRepo.saving_queue = list()
+        DocumentWriter.shut_down()
 
+        DocumentRepo.update_stubs()
         for stub in DocumentRepo.document_stubs_by_id.values():
             if 'files' in stub and len(stub['files']) > 0:
                 for filename in Files.get_document_files_list(stub['id']):
@@ -100,18 +295,12 @@ class DocumentRepo():
             else:
                 Files.delete_all_document_files(stub['id'])
 
-        for direntry in os.scandir(Files.get_stubs_folder()):
-            if direntry.is_file() and direntry.name.isdigit():
-                if not int(direntry.name) in DocumentRepo.document_stubs_by_id:
-                    os.remove(os.path.join(Files.get_stubs_folder(), direntry.name))
-
-        for thread in threading.enumerate():
-            try:
-                thread.join()
-            except RuntimeError:
-                pass
+        if DocumentRepo.stub_store_records > 2 * len(DocumentRepo.document_stubs_by_id):
+            DocumentRepo.compact_stub_store()
+        SearchIndex.save()
 
     def list():
+        DocumentRepo.update_stubs()
         return [stub for stub in sorted(DocumentRepo.document_stubs_by_id.values(), key=lambda stub: -stub['last_modified'])]
 
     @timer.timer
@@ -119,13 +308,10 @@ class DocumentRepo():
         if len(terms) == 0:
             return DocumentRepo.list()
 
-        result = []
-        for doc_stub in DocumentRepo.list():
-            for term in terms:
-                if min(x.casefold() in doc_stub['plaintext'].casefold() or x.casefold() in doc_stub['title'].casefold() for x in terms):
-                    result.append(doc_stub)
-                    break
-        return result
+        DocumentRepo.update_stubs()
+        SearchIndex.update(DocumentRepo.document_stubs_by_id)
+        document_ids = SearchIndex.get_ids_by_search_terms(terms)
+        return [doc_stub for doc_stub in DocumentRepo.list() if doc_stub['id'] in document_ids]
 
     def list_by_link_target(title):
         result = []
@@ -150,6 +336,7 @@ class DocumentRepo():
         return [stub for stub in DocumentRepo.list() if stub['title'] == title]
 
     def get_stub_by_id(document_id):
+        DocumentRepo.update_stubs()
         if document_id in DocumentRepo.document_stubs_by_id:
             return DocumentRepo.document_stubs_by_id[document_id]
         return None
@@ -159,14 +346,21 @@ class DocumentRepo():
         if document_id in DocumentRepo.saving_schedule:
             return DocumentRepo.saving_schedule[document_id][0]
 
+        DocumentWriter.wait_for(document_id)
+
         pathname = os.path.join(Files.get_documents_folder(), str(document_id))
         if not os.path.isfile(pathname): return None
 
         document = Document(document_id)
         document.last_modified = os.path.getmtime(pathname)
 
-        with open(pathname, 'r') as file:
-            xml = file.read()
+        if DocumentRecords.is_record_file(pathname):
+            head, paragraph_ids, xml_by_paragraph_id, record_count, is_intact = DocumentRecords.read(pathname)
+            xml = XMLExporter.join_document(head, [xml_by_paragraph_id[paragraph_id] for paragraph_id in paragraph_ids])
+        else:
+            paragraph_ids, is_intact = None, False
+            with open(pathname, 'r') as file:
+                xml = file.read()
 
         title, meta, paragraphs = XMLParser.parse(xml)
         if paragraphs != None:
@@ -177,12 +371,22 @@ class DocumentRepo():
             document.ast.remove(document.ast[0])
 
         document.title = title
+        DocumentRepo.revisions_by_id[document_id] = document.revision
+
+        # later saves can append to the records if every paragraph could be matched to its id
+        if is_intact and len(paragraph_ids) == len(document.ast):
+            DocumentRepo.paragraph_ids_by_document_id[document_id] = (dict(zip(document.ast, paragraph_ids)), max(paragraph_ids) + 1)
+            with DocumentRepo.stored_records_lock:
+                DocumentRepo.stored_records_by_document_id[document_id] = (xml_by_paragraph_id, record_count)
+        else:
+            DocumentRepo.forget_records(document_id)
 
         if 'insert-position' in meta: insert_pos = eval(meta['insert-position'])
         else: insert_pos = document.ast[0][0].get_position()
         if 'selection-position' in meta: selection_pos = eval(meta['selection-position'])
         else: selection_pos = document.ast[0][0].get_position()
         document.cursor.set_state([insert_pos, selection_pos])
+        DocumentRepo.cursor_states_by_id[document_id] = document.get_cursor_state()
 
         return document
 
@@ -194,86 +398,258 @@ class DocumentRepo():
     def add(document):
         if document.id in DocumentRepo.document_stubs_by_id: return
 
-        DocumentRepo.document_stubs_by_id[document.id] = {'id': document.id, 'last_modified': document.last_modified, 'title': document.title, 'plaintext': document.get_plaintext(), 'links': document.get_links(), 'files': document.get_files()}
-        DocumentRepo.save_document(document, can_wait=False)
+        DocumentRepo.document_stubs_by_id[document.id] = DocumentRepo.make_stub(document)
+        DocumentRepo.revisions_by_id[document.id] = document.revision
+        DocumentRepo.cursor_states_by_id[document.id] = document.get_cursor_state()
+        SearchIndex.invalidate(document.id)
+        DocumentRepo.schedule_write(document)
         DocumentRepo.max_document_id = max(document.id, DocumentRepo.max_document_id)
 
     @timer.timer
     def delete(document_id):
+        DocumentRepo.update_stubs()
         if document_id not in DocumentRepo.document_stubs_by_id: return
 
         if document_id in DocumentRepo.saving_schedule:
-            DocumentRepo.document_saving_lock.acquire()
-            DocumentRepo.stub_saving_lock.acquire()
             del(DocumentRepo.saving_schedule[document_id])
-            DocumentRepo.stub_saving_lock.release()
-            DocumentRepo.document_saving_lock.release()
+        DocumentRepo.outdated_documents_by_id.pop(document_id, None)
+        DocumentRepo.revisions_by_id.pop(document_id, None)
+        DocumentRepo.cursor_states_by_id.pop(document_id, None)
+        DocumentWriter.discard(document_id)
+        DocumentRepo.forget_records(document_id)
 
         pathname = os.path.join(Files.get_documents_folder(), str(document_id))
+        document_lock = DocumentRepo.get_document_lock(pathname)
+        document_lock.acquire()
         try:
             os.remove(pathname)
         except FileNotFoundError: pass
+        document_lock.release()
 
         del(DocumentRepo.document_stubs_by_id[document_id])
-        pathname = os.path.join(Files.get_stubs_folder(), str(document_id))
-        try:
-            os.remove(pathname)
-        except FileNotFoundError: pass
+        DocumentRepo.pending_ids.discard(document_id)
+        SearchIndex.remove(document_id)
+        DocumentRepo.write_stubs_to_disk([pickle.dumps((document_id, None, None))])
 
         Files.delete_all_document_files(document_id)
 
+    # changes that only moved the cursor just schedule a save, for the cursor
+    # position in the head of the file. Otherwise the stub is also marked as
+    # outdated and only made anew when stubs are read.
     @timer.timer
     def update(document):
-        DocumentRepo.document_stubs_by_id[document.id] = {'id': document.id, 'last_modified': document.last_modified, 'title': document.title, 'plaintext': document.get_plaintext(), 'links': document.get_links(), 'files': document.get_files()}
-        DocumentRepo.save_document(document, can_wait=True)
-
-    @timer.timer
-    def save_document(document, can_wait):
-        if can_wait:
-            DocumentRepo.saving_schedule[document.id] = (document, document.last_modified)
+        cursor_state = document.get_cursor_state()
+        if DocumentRepo.revisions_by_id.get(document.id) == document.revision:
+            if DocumentRepo.cursor_states_by_id.get(document.id) == cursor_state: return
+        else:
+            DocumentRepo.revisions_by_id[document.id] = document.revision
+            DocumentRepo.outdated_documents_by_id[document.id] = document
+            SearchIndex.invalidate(document.id)
+        DocumentRepo.cursor_states_by_id[document.id] = cursor_state
+
+        if document.id not in DocumentRepo.saving_schedule:
+            DocumentRepo.saving_schedule[document.id] = (document, time.time())
+            heapq.heappush(DocumentRepo.saving_queue, (DocumentRepo.get_saving_due_time(document.id), document.id))
         else:
-            pathname = os.path.join(Files.get_documents_folder(), str(document.id))
-            xml = document.get_xml()
-            DocumentRepo.write_document_to_disk(xml, pathname)
+            DocumentRepo.saving_schedule[document.id] = (document, DocumentRepo.saving_schedule[document.id][1])
+
+    def update_stubs():
+        if len(DocumentRepo.outdated_documents_by_id) == 0: return
+
+        for document_id, document in DocumentRepo.outdated_documents_by_id.items():
+            DocumentRepo.document_stubs_by_id[document_id] = DocumentRepo.make_stub(document)
+        DocumentRepo.outdated_documents_by_id = dict()
 
-            pathname = os.path.join(Files.get_stubs_folder(), str(document.id))
-            stub_file = pickle.dumps(DocumentRepo.document_stubs_by_id[document.id])
-            DocumentRepo.write_stub_to_disk(stub_file, pathname)
+    def make_stub(document):
+        return {'id': document.id, 'last_modified': document.last_modified, 'title': document.title, 'plaintext': document.get_plaintext(), 'links': document.get_links(), 'files': document.get_files()}
 
+    # every document is saved once it hasn't been modified, and its cursor hasn't
+    # moved, for saving_delay seconds, or at the latest max_saving_delay seconds
+    # after its first unsaved change.
+    # the queue holds one entry per scheduled document, entries that turn out to be
+    # early when they come up are pushed back with the current due time.
     def lazy_save_loop():
-        ready_to_save = list()
-        for document_id, data in DocumentRepo.saving_schedule.items():
-            if data[0].last_modified > data[1]: return True
-            if time.time() - data[1] < 5: return True
+        now = time.time()
+        while len(DocumentRepo.saving_queue) > 0 and DocumentRepo.saving_queue[0][0] <= now:
+            due_time, document_id = heapq.heappop(DocumentRepo.saving_queue)
+            if document_id not in DocumentRepo.saving_schedule: continue
+
+            due_time = DocumentRepo.get_saving_due_time(document_id)
+            if due_time > now:
+                heapq.heappush(DocumentRepo.saving_queue, (due_time, document_id))
+            else:
+                document = DocumentRepo.saving_schedule[document_id][0]
+                del(DocumentRepo.saving_schedule[document_id])
 
-            ready_to_save.append(document_id)
+                DocumentRepo.schedule_write(document)
 
-        for document_id in ready_to_save:
-            document = DocumentRepo.saving_schedule[document_id][0]
-            del(DocumentRepo.saving_schedule[document_id])
+        timer.Timer.record_max('repos.document_repo.pending_saves', DocumentRepo.get_pending_save_count())
+        timer.Timer.record_max('repos.document_repo.oldest_unsaved_age', DocumentRepo.get_oldest_unsaved_age())
+        return True
 
-            pathname = os.path.join(Files.get_documents_folder(), str(document.id))
-            xml = document.get_xml()
-            thread = threading.Thread(target=DocumentRepo.write_document_to_disk, args=(xml, pathname))
-            thread.start()
+    def get_saving_due_time(document_id):
+        document, first_unsaved_change = DocumentRepo.saving_schedule[document_id]
+        return min(document.last_cursor_movement + DocumentRepo.saving_delay, first_unsaved_change + DocumentRepo.max_saving_delay)
 
-            pathname = os.path.join(Files.get_stubs_folder(), str(document.id))
-            stub_file = pickle.dumps(DocumentRepo.document_stubs_by_id[document.id])
-            thread = threading.Thread(target=DocumentRepo.write_stub_to_disk, args=(stub_file, pathname))
-            thread.start()
+    def get_pending_save_count():
+        return len(DocumentRepo.saving_schedule) + DocumentWriter.get_pending_count()
 
-        return True
+    def get_oldest_unsaved_age():
+        if len(DocumentRepo.saving_schedule) == 0: return 0
+        return time.time() - min(first_unsaved_change for document, first_unsaved_change in DocumentRepo.saving_schedule.values())
+
+    def schedule_write(document):
+        DocumentRepo.update_stubs()
+        pathname = os.path.join(Files.get_documents_folder(), str(document.id))
+        if Settings.get_value('incremental_document_storage'):
+            paragraph_ids = DocumentRepo.get_paragraph_ids(document)
+        else:
+            paragraph_ids = None
+        DocumentWriter.add(document.id, (pathname, document.get_snapshot(), paragraph_ids, DocumentRepo.document_stubs_by_id[document.id]))
+
+    def get_paragraph_ids(document):
+        ids_by_paragraph, next_paragraph_id = DocumentRepo.paragraph_ids_by_document_id.get(document.id, (dict(), 0))
+
+        paragraph_ids = list()
+        for paragraph in document.ast:
+            if paragraph not in ids_by_paragraph:
+                ids_by_paragraph[paragraph] = next_paragraph_id
+                next_paragraph_id += 1
+            paragraph_ids.append(ids_by_paragraph[paragraph])
+
+        if len(ids_by_paragraph) > 2 * len(paragraph_ids):
+            ids_by_paragraph = dict(zip(document.ast, paragraph_ids))
+        DocumentRepo.paragraph_ids_by_document_id[document.id] = (ids_by_paragraph, next_paragraph_id)
+        return paragraph_ids
+
+    def forget_records(document_id):
+        if document_id in DocumentRepo.paragraph_ids_by_document_id:
+            del(DocumentRepo.paragraph_ids_by_document_id[document_id])
+        with DocumentRepo.stored_records_lock:
+            DocumentRepo.stored_records_by_document_id.pop(document_id, None)
+
+    # runs on the writer threads, which do the joining and encoding.
+    # in the record format only paragraphs that differ from the stored records
+    # are appended, and the file is rewritten from scratch every max_records_per_document saves.
+    # the main thread forgets stored records on reload and delete, so they are
+    # read and replaced under stored_records_lock, in one step per document.
+    def write_batch_to_disk(batch):
+        files_by_pathname = dict()
+        records_by_pathname = dict()
+        for pathname, snapshot, paragraph_ids, stub in batch:
+            head, paragraph_xmls = snapshot.head, snapshot.get_paragraph_xmls()
+
+            if paragraph_ids == None:
+                with DocumentRepo.stored_records_lock:
+                    DocumentRepo.stored_records_by_document_id.pop(stub['id'], None)
+                files_by_pathname[pathname] = XMLExporter.join_document(head, paragraph_xmls)
+                continue
+
+            xml_by_paragraph_id = dict(zip(paragraph_ids, paragraph_xmls))
+            with DocumentRepo.stored_records_lock:
+                stored_records = DocumentRepo.stored_records_by_document_id.get(stub['id'])
+                if stored_records == None or stored_records[1] >= DocumentRepo.max_records_per_document:
+                    DocumentRepo.stored_records_by_document_id[stub['id']] = (xml_by_paragraph_id, 1)
+                else:
+                    DocumentRepo.stored_records_by_document_id[stub['id']] = (xml_by_paragraph_id, stored_records[1] + 1)
+
+            if stored_records == None or stored_records[1] >= DocumentRepo.max_records_per_document:
+                files_by_pathname[pathname] = DocumentRecords.encode_full(head, paragraph_ids, xml_by_paragraph_id)
+            else:
+                stored_xml_by_paragraph_id = stored_records[0]
+                changed_xml_by_paragraph_id = {paragraph_id: xml for paragraph_id, xml in xml_by_paragraph_id.items() if stored_xml_by_paragraph_id.get(paragraph_id) != xml}
+                order_changed = (list(stored_xml_by_paragraph_id) != paragraph_ids)
+                records_by_pathname[pathname] = DocumentRecords.encode_update(head, paragraph_ids if order_changed else None, changed_xml_by_paragraph_id)
+
+        try:
+            file_mtimes_by_pathname = DocumentRepo.write_documents_to_disk(files_by_pathname)
+            file_mtimes_by_pathname.update(DocumentRepo.append_records_to_disk(records_by_pathname))
+        except Exception:
+            with DocumentRepo.stored_records_lock:
+                for pathname, snapshot, paragraph_ids, stub in batch:
+                    DocumentRepo.stored_records_by_document_id.pop(stub['id'], None)
+            raise
+        DocumentRepo.write_stubs_to_disk([pickle.dumps((stub['id'], file_mtimes_by_pathname[pathname], stub)) for pathname, snapshot, paragraph_ids, stub in batch])
+
+    # documents are written to a temporary file which is then renamed over the old
+    # version, so a crash leaves either the old or the new version on disk. all files
+    # of a batch are synced together, followed by a single sync of the folder.
+    # returns the mtimes of the written files, which are stored with the stubs.
+    @timer.timer
+    def write_documents_to_disk(xml_by_pathname):
+        if len(xml_by_pathname) == 0: return dict()
+
+        pathnames = sorted(xml_by_pathname)
+        document_locks = [DocumentRepo.get_document_lock(pathname) for pathname in pathnames]
+        for document_lock in document_locks:
+            document_lock.acquire()
+
+        try:
+            filehandles = list()
+            try:
+                for pathname in pathnames:
+                    filehandle = open(pathname + '.tmp', 'wb' if isinstance(xml_by_pathname[pathname], bytes) else 'w')
+                    filehandles.append(filehandle)
+                    filehandle.write(xml_by_pathname[pathname])
+                    filehandle.flush()
+                for filehandle in filehandles:
+                    os.fsync(filehandle.fileno())
+            finally:
+                for filehandle in filehandles:
+                    filehandle.close()
+
+            for pathname in pathnames:
+                os.replace(pathname + '.tmp', pathname)
+            DocumentRepo.sync_folder(Files.get_documents_folder())
+            return {pathname: os.path.getmtime(pathname) for pathname in pathnames}
+        finally:
+            for document_lock in document_locks:
+                document_lock.release()
+
+    @timer.timer
+    def append_records_to_disk(records_by_pathname):
+        if len(records_by_pathname) == 0: return dict()
+
+        pathnames = sorted(records_by_pathname)
+        document_locks = [DocumentRepo.get_document_lock(pathname) for pathname in pathnames]
+        for document_lock in document_locks:
+            document_lock.acquire()
+
+        try:
+            for pathname in pathnames:
+                with open(pathname, 'ab') as filehandle:
+                    filehandle.write(records_by_pathname[pathname])
+                    filehandle.flush()
+                    os.fsync(filehandle.fileno())
+            return {pathname: os.path.getmtime(pathname) for pathname in pathnames}
+        finally:
+            for document_lock in document_locks:
+                document_lock.release()
+
+    def get_document_lock(pathname):
+        DocumentRepo.document_locks_lock.acquire()
+        if pathname not in DocumentRepo.document_locks_by_pathname:
+            DocumentRepo.document_locks_by_pathname[pathname] = threading.Lock()
+        document_lock = DocumentRepo.document_locks_by_pathname[pathname]
+        DocumentRepo.document_locks_lock.release()
+        return document_lock
+
+    def sync_folder(pathname):
+        try:
+            folder = os.open(pathname, os.O_RDONLY)
+        except OSError: return
+        try:
+            os.fsync(folder)
+        except OSError: pass
+        os.close(folder)
 
-    def write_document_to_disk(xml, pathname):
-        DocumentRepo.document_saving_lock.acquire()
-        with open(pathname, 'w') as filehandle:
-            filehandle.write(xml)
-        DocumentRepo.document_saving_lock.release()
+    def write_stubs_to_disk(stub_records):
+        if len(stub_records) == 0: return
 
-    def write_stub_to_disk(stub_file, pathname):
         DocumentRepo.stub_saving_lock.acquire()
-        with open(pathname, 'wb') as filehandle:
-            filehandle.write(stub_file)
+        with open(os.path.join(Files.get_stubs_folder(), 'store'), 'ab') as filehandle:
+            filehandle.write(b''.join(stub_records))
+        DocumentRepo.stub_store_records += len(stub_records)
         DocumentRepo.stub_saving_lock.release()
 
 
@@ -24,30 +24,40 @@ from lemma.services.files import Files
 class WorkspaceRepo():
 
     workspace = None
+    workspace_data = dict()
 
-    def init(DocumentRepo):
-        WorkspaceRepo.workspace = Workspace()
-
+    def load():
         pathname = os.path.join(Files.get_documents_folder(), 'workspace')
-        workspace_data = None
         if os.path.isfile(pathname):
             with open(pathname, 'rb') as file:
                 try:
-                    workspace_data = pickle.loads(file.read())
+                    WorkspaceRepo.workspace_data = pickle.loads(file.read())
                 except EOFError: pass
-                else:
-                    if 'history' in workspace_data:
-                        for document_id in workspace_data['history']:
-                            if document_id in DocumentRepo.document_stubs_by_id:
-                                WorkspaceRepo.workspace.history.append(document_id)
-                    if 'bookmarks' in workspace_data:
-                        for document_id in workspace_data['bookmarks']:
-                            if document_id in DocumentRepo.document_stubs_by_id:
-                                WorkspaceRepo.workspace.bookmarked_document_ids.append(document_id)
-                    if 'active_document_id' in workspace_data:
-                        if workspace_data['active_document_id'] in DocumentRepo.document_stubs_by_id:
-                            document = DocumentRepo.get_by_id(workspace_data['active_document_id'])
-                            WorkspaceRepo.workspace.set_active_document(document, update_history=False)
+
+    def get_stored_document_ids():
+        document_ids = list()
+        if WorkspaceRepo.workspace_data.get('active_document_id') != None:
+            document_ids.append(WorkspaceRepo.workspace_data['active_document_id'])
+        document_ids += WorkspaceRepo.workspace_data.get('history', [])
+        document_ids += WorkspaceRepo.workspace_data.get('bookmarks', [])
+        return document_ids
+
+    def init(DocumentRepo):
+        WorkspaceRepo.workspace = Workspace()
+
+        workspace_data = WorkspaceRepo.workspace_data
+        if 'history' in workspace_data:
+            for document_id in workspace_data['history']:
+                if document_id in DocumentRepo.document_stubs_by_id:
+                    WorkspaceRepo.workspace.history.append(document_id)
+        if 'bookmarks' in workspace_data:
+            for document_id in workspace_data['bookmarks']:
+                if document_id in DocumentRepo.document_stubs_by_id:
+                    WorkspaceRepo.workspace.bookmarked_document_ids.append(document_id)
+        if 'active_document_id' in workspace_data:
+            if workspace_data['active_document_id'] in DocumentRepo.document_stubs_by_id:
+                document = DocumentRepo.get_by_id(workspace_data['active_document_id'])
+                WorkspaceRepo.workspace.set_active_document(document, update_history=False)
 
     def get_workspace():
         return WorkspaceRepo.workspace
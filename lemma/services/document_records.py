@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import json
+
+from lemma.services.xml_exporter import XMLExporter
+
+
+# Document files in the record format start with a magic line, followed by
+# records. Each record is a line with its length in bytes, then the record
+# as json and a newline. A 'full' record holds the head, the paragraph ids
+# in order and the xml of every paragraph. An 'update' record holds the head,
+# the order (or None if it didn't change) and only the xml of paragraphs that
+# changed since the previous record.
+class DocumentRecords():
+
+    magic = b'lemma-document-records\n'
+
+    def is_record_file(pathname):
+        with open(pathname, 'rb') as file:
+            return file.read(len(DocumentRecords.magic)) == DocumentRecords.magic
+
+    def read_xml(pathname):
+        if DocumentRecords.is_record_file(pathname):
+            head, paragraph_ids, xml_by_paragraph_id, record_count, is_intact = DocumentRecords.read(pathname)
+            return XMLExporter.join_document(head, [xml_by_paragraph_id[paragraph_id] for paragraph_id in paragraph_ids])
+
+        with open(pathname, 'r') as file:
+            return file.read()
+
+    def read(pathname):
+        head, paragraph_ids, xml_by_paragraph_id = '', [], dict()
+        record_count = 0
+
+        with open(pathname, 'rb') as file:
+            data = file.read()
+        end_of_last_record = len(DocumentRecords.magic)
+
+        while end_of_last_record < len(data):
+            try:
+                record_type, record_head, record_paragraph_ids, paragraph_xmls, end_of_record = DocumentRecords.decode(data, end_of_last_record)
+            except (ValueError, TypeError, AttributeError): break
+            else:
+                available_xmls = dict() if record_type == 'full' else dict(xml_by_paragraph_id)
+                available_xmls.update(paragraph_xmls)
+                if record_paragraph_ids == None:
+                    record_paragraph_ids = paragraph_ids
+                if not all(paragraph_id in available_xmls for paragraph_id in record_paragraph_ids): break
+
+                head, paragraph_ids = record_head, record_paragraph_ids
+                xml_by_paragraph_id = {paragraph_id: available_xmls[paragraph_id] for paragraph_id in paragraph_ids}
+                end_of_last_record = end_of_record
+                record_count += 1
+
+        # a partly written last record can be left behind by a crash
+        return head, paragraph_ids, xml_by_paragraph_id, record_count, end_of_last_record == len(data)
+
+    def encode_full(head, paragraph_ids, xml_by_paragraph_id):
+        return DocumentRecords.magic + DocumentRecords.encode('full', head, paragraph_ids, xml_by_paragraph_id)
+
+    def encode_update(head, paragraph_ids, changed_xml_by_paragraph_id):
+        return DocumentRecords.encode('update', head, paragraph_ids, changed_xml_by_paragraph_id)
+
+    def encode(record_type, head, paragraph_ids, xml_by_paragraph_id):
+        record = json.dumps([record_type, head, paragraph_ids, xml_by_paragraph_id], ensure_ascii=False).encode('utf-8')
+        return str(len(record)).encode('ascii') + b'\n' + record + b'\n'
+
+    # raises ValueError if the record at offset is cut off or malformed.
+    def decode(data, offset):
+        end_of_length = data.index(b'\n', offset)
+        start = end_of_length + 1
+        length = int(data[offset:end_of_length])
+        end = start + length
+        if length < 0 or end >= len(data) or data[end:end + 1] != b'\n': raise ValueError()
+
+        record_type, head, paragraph_ids, xml_by_paragraph_id = json.loads(data[start:end].decode('utf-8'))
+        if record_type not in {'full', 'update'} or not isinstance(head, str): raise ValueError()
+        if paragraph_ids != None and not all(isinstance(paragraph_id, int) for paragraph_id in paragraph_ids): raise ValueError()
+        if not all(isinstance(xml, str) for xml in xml_by_paragraph_id.values()): raise ValueError()
+        xml_by_paragraph_id = {int(paragraph_id): xml for paragraph_id, xml in xml_by_paragraph_id.items()}
+
+        return record_type, head, paragraph_ids, xml_by_paragraph_id, end + 1
+
+
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import threading, traceback
+
+
+# A fixed number of worker threads writing documents in batches. Only the
+# newest data added for a document id is kept, and an id is never handed to
+# two workers at once, so the versions of a document reach the disk in order.
+class DocumentWriter():
+
+    max_workers = 2
+    max_batch_size = 64
+
+    write_batch = None
+    workers = list()
+    pending_data_by_id = dict()
+    in_flight_ids = set()
+    condition = threading.Condition()
+    is_shutting_down = False
+
+    def init(write_batch):
+        DocumentWriter.write_batch = write_batch
+        DocumentWriter.is_shutting_down = False
+
+        DocumentWriter.workers = list()
+        for i in range(DocumentWriter.max_workers):
+            worker = threading.Thread(target=DocumentWriter.run_worker, daemon=True)
+            worker.start()
+            DocumentWriter.workers.append(worker)
+
+    def add(document_id, data):
+        with DocumentWriter.condition:
+            DocumentWriter.pending_data_by_id[document_id] = data
+            DocumentWriter.condition.notify_all()
+
+    def discard(document_id):
+        with DocumentWriter.condition:
+            if document_id in DocumentWriter.pending_data_by_id:
+                del(DocumentWriter.pending_data_by_id[document_id])
+            while document_id in DocumentWriter.in_flight_ids:
+                DocumentWriter.condition.wait()
+
+    def wait_for(document_id):
+        with DocumentWriter.condition:
+            while document_id in DocumentWriter.pending_data_by_id or document_id in DocumentWriter.in_flight_ids:
+                DocumentWriter.condition.wait()
+
+    def get_pending_count():
+        with DocumentWriter.condition:
+            return len(DocumentWriter.pending_data_by_id) + len(DocumentWriter.in_flight_ids)
+
+    def drain():
+        with DocumentWriter.condition:
+            while len(DocumentWriter.pending_data_by_id) > 0 or len(DocumentWriter.in_flight_ids) > 0:
+                DocumentWriter.condition.wait()
+
+    def shut_down():
+        DocumentWriter.drain()
+
+        with DocumentWriter.condition:
+            DocumentWriter.is_shutting_down = True
+            DocumentWriter.condition.notify_all()
+        for worker in DocumentWriter.workers:
+            worker.join()
+        DocumentWriter.workers = list()
+
+    def run_worker():
+        while True:
+            with DocumentWriter.condition:
+                while True:
+                    batch_ids = [document_id for document_id in DocumentWriter.pending_data_by_id if document_id not in DocumentWriter.in_flight_ids][:DocumentWriter.max_batch_size]
+                    if len(batch_ids) > 0 or DocumentWriter.is_shutting_down: break
+                    DocumentWriter.condition.wait()
+
+                if len(batch_ids) == 0: return
+
+                batch = list()
+                for document_id in batch_ids:
+                    batch.append(DocumentWriter.pending_data_by_id.pop(document_id))
+                    DocumentWriter.in_flight_ids.add(document_id)
+
+            try:
+                DocumentWriter.write_batch(batch)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with DocumentWriter.condition:
+                    DocumentWriter.in_flight_ids -= set(batch_ids)
+                    DocumentWriter.condition.notify_all()
+
+
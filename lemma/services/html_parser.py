@@ -18,7 +18,7 @@
 import urllib.parse, shutil, os.path
 from html.parser import HTMLParser as HTMLParserLib
 
-from lemma.document.ast import Root, Paragraph, Node
+from lemma.document.ast import Root, Paragraph, Node, get_interned_tags
 from lemma.widgets.factory import WidgetFactory
 from lemma.services.layout_info import LayoutInfo
 from lemma.services.files import Files
@@ -209,7 +209,7 @@ class HTMLParserObject(HTMLParserLib):
                     else:
                         continue
                 node = Node('char', char)
-                node.tags = self.tags.copy()
+                node.tags = get_interned_tags(self.tags)
                 if self.link_target != None:
                     node.link = self.link_target
                 self.composite.append(node)
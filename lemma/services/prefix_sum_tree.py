@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+
+
+# A segment tree over a list of numbers, where changing a value and the sum
+# of all values before an index both take O(log n). The sums of inner nodes
+# are always recomputed from their children instead of being adjusted by the
+# difference, so float values don't accumulate rounding errors.
+class PrefixSumTree(object):
+
+    def __init__(self, values=[]):
+        self.length = len(values)
+        self.size = 1
+        while self.size < self.length:
+            self.size *= 2
+
+        self.sums = [0] * (2 * self.size)
+        self.sums[self.size:self.size + self.length] = values
+        for i in range(self.size - 1, 0, -1):
+            self.sums[i] = self.sums[2 * i] + self.sums[2 * i + 1]
+
+    def __len__(self):
+        return self.length
+
+    def get(self, index):
+        return self.sums[self.size + index]
+
+    def set(self, index, value):
+        i = self.size + index
+        self.sums[i] = value
+        i //= 2
+        while i > 0:
+            self.sums[i] = self.sums[2 * i] + self.sums[2 * i + 1]
+            i //= 2
+
+    def get_total(self):
+        return self.sums[1]
+
+    def get_prefix_sum(self, index):
+        if index >= self.length: return self.sums[1]
+
+        result = 0
+        i = self.size + index
+        while i > 1:
+            if i % 2 == 1:
+                result += self.sums[i - 1]
+            i //= 2
+        return result
+
+    # the index of the value whose interval [prefix sum, prefix sum + value)
+    # contains the offset. Offsets past the total give len(self).
+    def find(self, offset):
+        if offset >= self.sums[1]: return self.length
+        if offset < 0: return 0
+
+        i = 1
+        while i < self.size:
+            if offset < self.sums[2 * i]:
+                i = 2 * i
+            else:
+                offset -= self.sums[2 * i]
+                i = 2 * i + 1
+        return i - self.size
+
+
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import os.path, os, pickle, threading
+
+from lemma.services.files import Files
+import lemma.services.timer as timer
+
+
+# Inverted index from n-grams (up to length 3) of the casefolded words in
+# each document to the ids of the documents containing them. Search terms
+# never contain whitespace, so a term matches a document iff it is a
+# substring of its casefolded title or plaintext.
+# The index is stored next to the stub store on wrap up, and loaded by the
+# stub loader thread. Documents that aren't in the stored index, or whose
+# stub changed since, are indexed from the stubs as they are loaded. After
+# changes the index is updated on the main thread. For each document it keeps
+# the stub it was indexed from, to know which grams to remove later.
+class SearchIndex():
+
+    max_gram_length = 3
+
+    ids_by_gram = dict()
+    indexed_stubs_by_id = dict()
+    outdated_ids = set()
+    lock = threading.Lock()
+
+    # postings are stored with the last_modified of the stub they were made
+    # from, and only kept if the loaded stub is the same. documents indexed
+    # by the main thread in the meantime are left out.
+    @timer.timer
+    def load(stubs_by_id):
+        pathname = os.path.join(Files.get_stubs_folder(), 'search_index')
+        if not os.path.isfile(pathname): return
+
+        with open(pathname, 'rb') as file:
+            try:
+                data = pickle.load(file)
+            except (EOFError, pickle.UnpicklingError, ValueError): return
+        ids_by_gram, last_modified_by_id = data['ids_by_gram'], data['last_modified_by_id']
+
+        valid_ids = {document_id for document_id, last_modified in last_modified_by_id.items() if document_id in stubs_by_id and stubs_by_id[document_id]['last_modified'] == last_modified}
+        with SearchIndex.lock:
+            valid_ids -= SearchIndex.indexed_stubs_by_id.keys()
+        for ids in ids_by_gram.values():
+            ids &= valid_ids
+
+        with SearchIndex.lock:
+            indexed_ids = valid_ids & SearchIndex.indexed_stubs_by_id.keys()
+            if len(indexed_ids) > 0:
+                valid_ids -= indexed_ids
+                for ids in ids_by_gram.values():
+                    ids -= indexed_ids
+
+            for gram, ids in ids_by_gram.items():
+                if len(ids) == 0: continue
+                if gram in SearchIndex.ids_by_gram:
+                    SearchIndex.ids_by_gram[gram] |= ids
+                else:
+                    SearchIndex.ids_by_gram[gram] = ids
+            for document_id in valid_ids:
+                SearchIndex.indexed_stubs_by_id[document_id] = stubs_by_id[document_id]
+
+    @timer.timer
+    def save():
+        pathname = os.path.join(Files.get_stubs_folder(), 'search_index')
+
+        with SearchIndex.lock:
+            data = {'ids_by_gram': SearchIndex.ids_by_gram,
+                    'last_modified_by_id': {document_id: stub['last_modified'] for document_id, stub in SearchIndex.indexed_stubs_by_id.items()}}
+
+            try: filehandle = open(pathname + '.tmp', 'wb')
+            except IOError: return
+            with filehandle:
+                pickle.dump(data, filehandle)
+        os.replace(pathname + '.tmp', pathname)
+
+    # stubs of documents that are already indexed are skipped, the main
+    # thread may have indexed a newer version of them in the meantime.
+    @timer.timer
+    def add_stubs(stubs):
+        with SearchIndex.lock:
+            stubs = [stub for stub in stubs if stub['id'] not in SearchIndex.indexed_stubs_by_id]
+        grams_by_stub = [(stub, SearchIndex.get_stub_grams(stub)) for stub in stubs]
+
+        with SearchIndex.lock:
+            for stub, grams in grams_by_stub:
+                if stub['id'] in SearchIndex.indexed_stubs_by_id: continue
+
+                SearchIndex.add_postings(stub['id'], grams)
+                SearchIndex.indexed_stubs_by_id[stub['id']] = stub
+
+    def remove_all_except(document_ids):
+        with SearchIndex.lock:
+            for document_id in list(SearchIndex.indexed_stubs_by_id):
+                if document_id not in document_ids:
+                    SearchIndex.remove_document(document_id)
+
+    def invalidate(document_id):
+        SearchIndex.outdated_ids.add(document_id)
+
+    def remove(document_id):
+        with SearchIndex.lock:
+            SearchIndex.remove_document(document_id)
+
+    def remove_document(document_id):
+        SearchIndex.outdated_ids.discard(document_id)
+        if document_id not in SearchIndex.indexed_stubs_by_id: return
+
+        SearchIndex.remove_postings(document_id, SearchIndex.get_stub_grams(SearchIndex.indexed_stubs_by_id[document_id]))
+        del(SearchIndex.indexed_stubs_by_id[document_id])
+
+    @timer.timer
+    def update(document_stubs_by_id):
+        with SearchIndex.lock:
+            for document_id in SearchIndex.outdated_ids:
+                stub = document_stubs_by_id[document_id]
+                grams = SearchIndex.get_stub_grams(stub)
+
+                if document_id in SearchIndex.indexed_stubs_by_id:
+                    old_grams = SearchIndex.get_stub_grams(SearchIndex.indexed_stubs_by_id[document_id])
+                    SearchIndex.remove_postings(document_id, old_grams - grams)
+                    grams -= old_grams
+
+                SearchIndex.add_postings(document_id, grams)
+                SearchIndex.indexed_stubs_by_id[document_id] = stub
+
+            SearchIndex.outdated_ids = set()
+
+    def add_postings(document_id, grams):
+        for gram in grams:
+            if gram not in SearchIndex.ids_by_gram:
+                SearchIndex.ids_by_gram[gram] = set()
+            SearchIndex.ids_by_gram[gram].add(document_id)
+
+    def remove_postings(document_id, grams):
+        for gram in grams:
+            ids = SearchIndex.ids_by_gram[gram]
+            ids.discard(document_id)
+            if len(ids) == 0:
+                del(SearchIndex.ids_by_gram[gram])
+
+    @timer.timer
+    def get_ids_by_search_terms(terms):
+        with SearchIndex.lock:
+            result = None
+            for term in sorted(set(term.casefold() for term in terms), key=lambda term: -len(term)):
+                if len(term) <= SearchIndex.max_gram_length:
+                    ids = SearchIndex.ids_by_gram.get(term, set()).copy()
+                else:
+                    ids = None
+                    for gram in sorted(SearchIndex.get_grams([term], exact_length=True), key=lambda gram: len(SearchIndex.ids_by_gram.get(gram, ()))):
+                        postings = SearchIndex.ids_by_gram.get(gram, set())
+                        ids = postings.copy() if ids == None else ids & postings
+                        if len(ids) == 0: break
+                    ids = {document_id for document_id in ids if SearchIndex.stub_contains(SearchIndex.indexed_stubs_by_id[document_id], term)}
+
+                result = ids if result == None else result & ids
+                if len(result) == 0: break
+
+        return result if result != None else set()
+
+    def stub_contains(stub, term):
+        return term in stub['title'].casefold() or term in stub['plaintext'].casefold()
+
+    def get_stub_grams(stub):
+        return SearchIndex.get_grams(set(stub['title'].casefold().split()) | set(stub['plaintext'].casefold().split()))
+
+    def get_grams(words, exact_length=False):
+        lengths = [SearchIndex.max_gram_length] if exact_length else range(1, SearchIndex.max_gram_length + 1)
+
+        grams = set()
+        for word in words:
+            for length in lengths:
+                for i in range(len(word) - length + 1):
+                    grams.add(word[i:i + length])
+        return grams
+
+
@@ -33,6 +33,7 @@ class Settings():
         Settings.defaults['font_theme'] = 'sans'
         Settings.defaults['update_backlinks'] = True
         Settings.defaults['stylized_latex_autocomplete'] = True
+        Settings.defaults['incremental_document_storage'] = False
 
         Settings.defaults['width'] = 1020
         Settings.defaults['height'] = 550
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import xml.parsers.expat
+
+from lemma.widgets.factory import WidgetFactory
+import lemma.services.xml_helpers as xml_helpers
+
+
+# Computes title, plaintext, links and files of a document directly from
+# the expat events, with the same result as parsing it with XMLParser and
+# querying the resulting Document, but without building the ast.
+class StubExtractor():
+
+    def extract(xml_string):
+        extractor = StubExtractorObject()
+        extractor.extract(xml_string)
+
+        return extractor.title, extractor.plaintext, extractor.links, extractor.files
+
+
+class StubExtractorObject(object):
+
+    def __init__(self):
+        self.expat_parser = xml.parsers.expat.ParserCreate()
+        self.expat_parser.StartElementHandler = self.handle_starttag
+        self.expat_parser.EndElementHandler = self.handle_endtag
+        self.expat_parser.CharacterDataHandler = self.handle_data
+
+        self.open_xml_tags = []
+        self.level = 0
+        self.current_link = [None for i in range(20)]
+
+        # top level nodes of the paragraph currently being read
+        self.texts = []
+        self.paragraph_links = set()
+        self.paragraph_files = set()
+        self.node_count = 0
+        self.last_node_type = None
+        self.paragraph_count = 0
+
+        self.plaintext_fragments = []
+        self.title = ''
+        self.plaintext = ''
+        self.links = set()
+        self.files = set()
+
+    def extract(self, xml_string):
+        xml_string = '<?xml version="1.0" encoding="utf-8"?><list>' + xml_string + '</list>'
+        try:
+            self.expat_parser.Parse(xml_string, 1)
+        except xml.parsers.expat.ExpatError:
+            self.plaintext_fragments, self.links, self.files = [], set(), set()
+        else:
+            if self.paragraph_count == 0 and self.node_count > 0:
+                self.add_paragraph()
+
+        if len(self.plaintext_fragments) == 0:
+            self.plaintext = '\n'
+        else:
+            self.plaintext = ''.join(self.plaintext_fragments)
+
+    def add_paragraph(self):
+        if self.node_count > 0 and self.last_node_type == 'eol':
+            self.plaintext_fragments += self.texts
+            self.links |= self.paragraph_links
+            self.files |= self.paragraph_files
+
+        self.texts = []
+        self.paragraph_links = set()
+        self.paragraph_files = set()
+        self.node_count = 0
+        self.last_node_type = None
+        self.paragraph_count += 1
+
+    def handle_starttag(self, tag, attrs):
+        self.open_xml_tags.append(tag)
+
+        if tag == 'a' and 'href' in attrs:
+            self.current_link[self.level] = xml_helpers.unescape(attrs['href'])
+
+        if tag in ['mathscript', 'mathfraction', 'mathroot', 'mathlist', 'end', 'placeholder']:
+            if self.level == 0:
+                self.node_count += 1
+                self.last_node_type = tag
+            self.level += 1
+
+        if tag == 'widget':
+            attributes = dict()
+            for key, value in attrs.items():
+                if key != 'type':
+                    attributes[key] = value
+
+            widget = WidgetFactory.make_widget(attrs['type'], attributes)
+            if widget != None:
+                if self.level == 0:
+                    self.node_count += 1
+                    self.last_node_type = 'widget'
+                    self.texts.append(widget.to_plaintext())
+                    self.paragraph_files |= widget.get_filenames()
+                self.level += 1
+
+    def handle_endtag(self, tag):
+        self.open_xml_tags.pop()
+
+        if tag in ['p', 'h2', 'h3', 'h4', 'h5', 'h6', 'ul', 'ol', 'cl']:
+            self.add_paragraph()
+
+        if tag == 'a':
+            self.current_link[self.level] = None
+
+        if self.level > 0 and tag in ['mathscript', 'mathfraction', 'mathroot', 'mathlist', 'end', 'placeholder', 'widget']:
+            self.level -= 1
+
+    def handle_data(self, data):
+        if 'head' in self.open_xml_tags and 'title' in self.open_xml_tags:
+            self.title += data
+
+        elif self.level == 0 and len(data) > 0:
+            self.texts.append(data)
+            self.node_count += len(data)
+            self.last_node_type = 'eol' if data[-1] == '\n' else 'char'
+            if self.current_link[0] != None and data.replace('\n', '') != '':
+                self.paragraph_links.add(self.current_link[0])
@@ -15,7 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 
-import time
+import time, threading
 
 
 def timer(original_function):
@@ -31,25 +31,37 @@ def timer(original_function):
 
 class Timer():
 
-    in_progress = []
+    in_progress_by_thread = dict()
     times = list()
     times_by_name = dict()
     hierarchy = {'count': 0, 'time': 0, 'children': dict()}
+    max_values = dict()
 
     def start(name):
-        Timer.in_progress.append([name, time.time()])
+        thread_id = threading.get_ident()
+        if thread_id not in Timer.in_progress_by_thread:
+            Timer.in_progress_by_thread[thread_id] = []
+        Timer.in_progress_by_thread[thread_id].append([name, time.time()])
 
     def stop(name):
+        in_progress = Timer.in_progress_by_thread[threading.get_ident()]
+
         node = Timer.hierarchy
-        for ancestor in Timer.in_progress:
+        for ancestor in in_progress:
             if ancestor[0] not in node['children']:
                 node['children'][ancestor[0]] = {'count': 0, 'time': 0, 'children': dict()}
             node = node['children'][ancestor[0]]
 
-        exectime = time.time() - Timer.in_progress.pop()[1]
+        exectime = time.time() - in_progress.pop()[1]
         node['count'] += 1
         node['time'] += exectime
 
+    # keeps the highest value seen for a metric that isn't a duration,
+    # e.g. the length of a queue.
+    def record_max(name, value):
+        if value > Timer.max_values.get(name, 0):
+            Timer.max_values[name] = value
+
     def print(only_cumulative=True):
         for (name, time) in Timer.times:
             if not only_cumulative:
@@ -60,6 +72,11 @@ class Timer():
 
         Timer.print_hierarchy(Timer.hierarchy, 0)
 
+        if len(Timer.max_values) > 0:
+            print('\n-------------------\nMaximum Values\n-------------------\n')
+            for name in sorted(Timer.max_values):
+                print(name + ': ' + ' '*(60 - len(name)) + '{:8.3f}'.format(Timer.max_values[name]))
+
     def print_hierarchy(hierarchy, spaces):
         for name in sorted(hierarchy['children'], key=lambda name: -hierarchy['children'][name]['time']):
             count = hierarchy['children'][name]['count']
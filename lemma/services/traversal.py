@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+
+def get_node_children(node):
+    return node.children
+
+def get_node_type(node):
+    return node.type
+
+def get_layout_children(layout):
+    return layout.children
+
+def get_layout_type(layout):
+    return layout.type
+
+
+# Walks over ast and layout trees with an explicit stack instead of
+# recursion, yielding one item at a time, so there are neither intermediate
+# lists nor limits on the depth of nested math.
+class Traversal():
+
+    def pre_order(tree, get_children=get_node_children):
+        stack = [tree]
+        while len(stack) > 0:
+            item = stack.pop()
+            yield item
+            stack += get_children(item)[::-1]
+
+    def post_order(tree, get_children=get_node_children):
+        stack = [(tree, False)]
+        while len(stack) > 0:
+            item, children_done = stack.pop()
+            if children_done:
+                yield item
+            else:
+                stack.append((item, True))
+                stack += [(child, False) for child in get_children(item)[::-1]]
+
+    def by_type(tree, types, get_children=get_node_children, get_type=get_node_type):
+        for item in Traversal.pre_order(tree, get_children):
+            if get_type(item) in types:
+                yield item
+
+    def layout_pre_order(layout_tree):
+        return Traversal.pre_order(layout_tree, get_layout_children)
+
+    def layout_by_type(layout_tree, types):
+        return Traversal.by_type(layout_tree, types, get_layout_children, get_layout_type)
+
+
@@ -22,6 +22,9 @@ import lemma.services.xml_helpers as xml_helpers
 
 class XMLExporter():
 
+    def join_document(head, paragraph_xmls):
+        return head + '<root>' + ''.join(paragraph_xmls) + '</root>'
+
     def export_paragraph(nodes, style='p', indentation_level=0, state=None):
         state_attr = ' state="' + state + '"' if state != None else ''
         xml = '<' + style + ' indentation_level="' + str(indentation_level) + '"' + state_attr + '>'
@@ -17,7 +17,7 @@
 
 import xml.parsers.expat
 
-from lemma.document.ast import Paragraph, Node
+from lemma.document.ast import Paragraph, Node, get_interned_tags, no_tags
 from lemma.widgets.factory import WidgetFactory
 import lemma.services.xml_helpers as xml_helpers
 
@@ -47,7 +47,7 @@ class XMLParserObject(object):
 
         self.level = 0
         self.current_link = [None for i in range(20)]
-        self.current_tags = [set() for i in range(20)]
+        self.current_tags = [no_tags for i in range(20)]
         self.current_indentation_level = 0
         self.current_paragraph_state = 0
 
@@ -60,7 +60,7 @@ class XMLParserObject(object):
         self.current_node = None
         self.level = 0
         self.current_link = [None for i in range(20)]
-        self.current_tags = [set() for i in range(20)]
+        self.current_tags = [no_tags for i in range(20)]
         self.title = ''
 
         xml_string = '<?xml version="1.0" encoding="utf-8"?><list>' + xml_string + '</list>'
@@ -85,13 +85,13 @@ class XMLParserObject(object):
         if tag == 'a' and 'href' in attrs:
             self.current_link[self.level] = xml_helpers.unescape(attrs['href'])
         if tag == 'em':
-            self.current_tags[self.level].add('italic')
+            self.current_tags[self.level] = get_interned_tags(self.current_tags[self.level] | {'italic'})
         if tag == 'strong':
-            self.current_tags[self.level].add('bold')
+            self.current_tags[self.level] = get_interned_tags(self.current_tags[self.level] | {'bold'})
         if tag == 'code':
-            self.current_tags[self.level].add('verbatim')
+            self.current_tags[self.level] = get_interned_tags(self.current_tags[self.level] | {'verbatim'})
         if tag == 'mark':
-            self.current_tags[self.level].add('highlight')
+            self.current_tags[self.level] = get_interned_tags(self.current_tags[self.level] | {'highlight'})
 
         if tag in ['p', 'h2', 'h3', 'h4', 'h5', 'h6', 'ul', 'ol', 'cl']:
             if 'indentation_level' in attrs:
@@ -128,7 +128,7 @@ class XMLParserObject(object):
 
             if node != None:
                 node.link = self.current_link[self.level]
-                node.tags = self.current_tags[self.level].copy()
+                node.tags = self.current_tags[self.level]
 
                 if self.current_node != None:
                     self.current_node.append(node)
@@ -154,13 +154,13 @@ class XMLParserObject(object):
         if tag == 'a':
             self.current_link[self.level] = None
         if tag == 'em':
-            self.current_tags[self.level].discard('italic')
+            self.current_tags[self.level] = get_interned_tags(self.current_tags[self.level] - {'italic'})
         if tag == 'strong':
-            self.current_tags[self.level].discard('bold')
+            self.current_tags[self.level] = get_interned_tags(self.current_tags[self.level] - {'bold'})
         if tag == 'code':
-            self.current_tags[self.level].discard('verbatim')
+            self.current_tags[self.level] = get_interned_tags(self.current_tags[self.level] - {'verbatim'})
         if tag == 'mark':
-            self.current_tags[self.level].discard('highlight')
+            self.current_tags[self.level] = get_interned_tags(self.current_tags[self.level] - {'highlight'})
 
         if self.current_node != None and tag in ['mathscript', 'mathfraction', 'mathroot', 'mathlist', 'end', 'placeholder', 'widget']:
             if self.current_node.parent != None:
@@ -180,7 +180,7 @@ class XMLParserObject(object):
                 else:
                     node = Node('char', char)
                 node.link = self.current_link[self.level]
-                node.tags = self.current_tags[self.level].copy()
+                node.tags = self.current_tags[self.level]
 
                 if self.current_node != None:
                     self.current_node.append(node)
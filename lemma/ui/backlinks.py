@@ -40,12 +40,13 @@ class Backlinks(object):
         MessageBus.subscribe(self, 'document_removed')
         MessageBus.subscribe(self, 'document_ast_changed')
         MessageBus.subscribe(self, 'mode_set')
+        MessageBus.subscribe(self, 'document_stubs_loaded')
 
         self.update()
 
     def animate(self):
         messages = MessageBus.get_messages(self)
-        if 'new_active_document' in messages or 'document_removed' in messages or 'document_ast_changed' in messages or 'mode_set' in messages:
+        if 'new_active_document' in messages or 'document_removed' in messages or 'document_ast_changed' in messages or 'mode_set' in messages or 'document_stubs_loaded' in messages:
             self.update()
 
     @timer.timer
@@ -23,6 +23,8 @@ import os, shutil
 
 from lemma.services.color_manager import ColorManager
 from lemma.services.files import Files
+from lemma.services.settings import Settings
+from lemma.use_cases.use_cases import UseCases
 import lemma.services.timer as timer
 
 
@@ -37,6 +39,9 @@ class PageStorage(object):
     def init(self):
         self.view.folder_label.set_text(Files.get_documents_folder())
 
+        self.view.checkbox_incremental.set_active(Settings.get_value('incremental_document_storage'))
+        self.view.checkbox_incremental.connect('toggled', self.on_checkbutton_toggled, 'incremental_document_storage')
+
         lemma_disk_space = sum([file.stat().st_size for file in os.scandir(Files.get_documents_folder())])
         total_disk_space, used_disk_space, free_disk_space = shutil.disk_usage(Files.get_documents_folder())
         system_disk_space = used_disk_space - lemma_disk_space
@@ -63,6 +68,9 @@ class PageStorage(object):
         else:
             self.view.freespace_size.set_text('{0:.2f} MB'.format(free_disk_space / 1024 / 1024))
 
+    def on_checkbutton_toggled(self, button, key):
+        UseCases.settings_set_value(key, button.get_active())
+
 
 class PageStorageView(Gtk.Box):
 
@@ -81,6 +89,15 @@ class PageStorageView(Gtk.Box):
         self.folder_label.set_xalign(0)
         self.folder_label.set_margin_top(18)
 
+        self.format_header = Gtk.Label.new(_('File Format'))
+        self.format_header.add_css_class('settings-header')
+        self.format_header.set_xalign(0)
+        self.format_header.set_margin_top(36)
+
+        self.checkbox_incremental = Gtk.CheckButton.new_with_label(_('Save only the changed paragraphs of documents (files are no longer plain XML)'))
+        self.checkbox_incremental.add_css_class('single')
+        self.checkbox_incremental.set_margin_top(18)
+
         self.disk_use_header = Gtk.Label.new(_('Disk Use'))
         self.disk_use_header.add_css_class('settings-header')
         self.disk_use_header.set_xalign(0)
@@ -167,6 +184,8 @@ class PageStorageView(Gtk.Box):
         self.vbox = Gtk.Box.new(Gtk.Orientation.VERTICAL, 0)
         self.vbox.append(self.folder_header)
         self.vbox.append(self.folder_label)
+        self.vbox.append(self.format_header)
+        self.vbox.append(self.checkbox_incremental)
         self.vbox.append(self.disk_use_header)
         self.vbox.append(self.disk_scale_labels_box)
         self.vbox.append(self.storage_scale)
@@ -95,6 +95,7 @@ class DocumentList(object):
         MessageBus.subscribe(self, 'document_ast_changed')
         MessageBus.subscribe(self, 'document_title_changed')
         MessageBus.subscribe(self, 'mode_set')
+        MessageBus.subscribe(self, 'document_stubs_loaded')
 
         self.update_active_document()
         self.update_document_list()
@@ -104,7 +105,7 @@ class DocumentList(object):
         if 'new_active_document' in messages or 'mode_set' in messages:
             self.update_active_document()
 
-        if 'new_document' in messages or 'document_removed' in messages or 'document_ast_changed' in messages or 'document_title_changed' in messages:
+        if 'new_document' in messages or 'document_removed' in messages or 'document_ast_changed' in messages or 'document_title_changed' in messages or 'document_stubs_loaded' in messages:
             self.update_document_list()
         self.update_scrolling_offset()
 
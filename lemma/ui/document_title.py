@@ -116,19 +116,7 @@ class DocumentTitle():
         UseCases.set_title(title)
 
         if Settings.get_value('update_backlinks'):
-            backlinks = DocumentRepo.list_by_link_target(prev_title)
-            for document_stub in reversed(backlinks):
-                linking_doc = DocumentRepo.get_by_id(document_stub['id'])
-                links = linking_doc.get_link_bounds_and_targets()
-                for link in links:
-                    bounds, target = link
-                    if target == prev_title:
-                        char_nodes = [node.value for node in linking_doc.get_subtree(*bounds) if node.type == 'char']
-                        if ''.join(char_nodes) == target:
-                            xml = '<a href="' + xml_helpers.escape(title) + '">' + xml_helpers.escape(title) + '</a>'
-                            UseCases.replace_section(linking_doc, bounds[0], bounds[1], xml)
-                        else:
-                            UseCases.set_link(linking_doc, bounds, title)
+            DocumentRepo.call_when_all_stubs_loaded(lambda: self.update_backlinks(prev_title, title))
 
         self.view.title_entry.remove_css_class('active')
         self.view.button_revealer.set_reveal_child(False)
@@ -136,6 +124,21 @@ class DocumentTitle():
 
         self.is_active = False
 
+    def update_backlinks(self, prev_title, title):
+        backlinks = DocumentRepo.list_by_link_target(prev_title)
+        for document_stub in reversed(backlinks):
+            linking_doc = DocumentRepo.get_by_id(document_stub['id'])
+            links = linking_doc.get_link_bounds_and_targets()
+            for link in links:
+                bounds, target = link
+                if target == prev_title:
+                    char_nodes = [node.value for node in linking_doc.get_subtree(*bounds) if node.type == 'char']
+                    if ''.join(char_nodes) == target:
+                        xml = '<a href="' + xml_helpers.escape(title) + '">' + xml_helpers.escape(title) + '</a>'
+                        UseCases.replace_section(linking_doc, bounds[0], bounds[1], xml)
+                    else:
+                        UseCases.set_link(linking_doc, bounds, title)
+
     def cancel(self):
         self.reset_title()
 
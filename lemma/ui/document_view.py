@@ -64,6 +64,7 @@ class DocumentView():
         MessageBus.subscribe(self, 'separate_dark_color_scheme_settings_changed')
         MessageBus.subscribe(self, 'font_theme_settings_changed')
         MessageBus.subscribe(self, 'dark_mode_changed')
+        MessageBus.subscribe(self, 'document_stubs_loaded')
 
         self.view.content.grab_focus()
 
@@ -93,12 +94,22 @@ class DocumentView():
             self.view.scrollbar_vertical.set_content_height(content_height)
             self.view.scrollbar_vertical.set_scrolling_offset(current_scrolling_y)
 
-        if 'new_active_document' in messages or 'document_ast_or_cursor_changed' in messages or 'preedit_changed' in messages or 'dark_mode_changed' in messages or 'color_scheme_settings_changed' in messages or 'color_scheme_dark_settings_changed' in messages or 'separate_dark_color_scheme_settings_changed' in messages or 'font_theme_settings_changed' in messages:
+        if 'document_ast_or_cursor_changed' in messages:
+            self.application.keyboard.reset_cursor_blink()
+            self.view.queue_allocate()
+            self.view.content.queue_draw()
+
+        if 'new_active_document' in messages or 'preedit_changed' in messages or 'dark_mode_changed' in messages or 'color_scheme_settings_changed' in messages or 'color_scheme_dark_settings_changed' in messages or 'separate_dark_color_scheme_settings_changed' in messages or 'font_theme_settings_changed' in messages:
             self.clear_render_cache()
             self.application.keyboard.reset_cursor_blink()
             self.view.queue_allocate()
             self.view.content.queue_draw()
 
+        # link colors depend on which documents exist
+        if 'document_stubs_loaded' in messages or 'new_document' in messages or 'document_removed' in messages or 'document_title_changed' in messages:
+            self.clear_render_cache()
+            self.view.content.queue_draw()
+
         self.update_link_overlay_text()
 
     def update_link_overlay_text(self):
@@ -148,10 +159,17 @@ class DocumentView():
         self.first_selection_line = document_layout.get_ancestors(document_layout.get_node_layout(self.first_selection_node))[-2]
         self.last_selection_line = document_layout.get_ancestors(document_layout.get_node_layout(self.last_selection_node))[-2]
 
+        offset_change = document_layout.update_viewport(-content_offset_y, view_height - content_offset_y)
+        if offset_change != 0:
+            ApplicationState.shift_scrolling_position(self.document.id, offset_change)
+            content_offset_y -= offset_change
+        first_selection_line_y = self.first_selection_line['y'] + self.first_selection_line['parent']['y']
+        last_selection_line_y = self.last_selection_line['y'] + self.last_selection_line['parent']['y']
+
         ctx = snapshot.append_cairo(Graphene.Rect().init(0, 0, view_width, view_height))
 
         ctx.scale(self.hidpi_factor_inverted, self.hidpi_factor_inverted)
-        in_selection = False
+        visible_lines = set()
         list_item_numbers = [0, 0, 0, 0, 0]
         for i, paragraph in enumerate(self.document.ast):
             if paragraph.style == 'ol':
@@ -161,23 +179,30 @@ class DocumentView():
             else:
                 list_item_numbers = list_item_numbers[:paragraph.indentation_level] + [0, 0, 0, 0, 0][paragraph.indentation_level:]
 
-            if content_offset_y + document_layout.get_paragraph_layout(paragraph)['y'] + document_layout.get_paragraph_layout(paragraph)['height'] >= 0 and content_offset_y + document_layout.get_paragraph_layout(paragraph)['y'] <= view_height:
-                self.draw_bullet(ctx, content_offset_x, content_offset_y, paragraph, list_item_numbers)
+            paragraph_y, paragraph_height = document_layout.get_paragraph_extents(paragraph)
+            if content_offset_y + paragraph_y > view_height: break
+            if content_offset_y + paragraph_y + paragraph_height < 0: continue
+
+            self.draw_bullet(ctx, content_offset_x, content_offset_y, paragraph, list_item_numbers)
+
+            paragraph_layout = document_layout.get_paragraph_layout(paragraph)
+            for j, line_layout in enumerate(paragraph_layout['children']):
+                layout_y = paragraph_layout['y'] + line_layout['y']
+                in_selection = (layout_y > first_selection_line_y and layout_y <= last_selection_line_y)
 
-            for j, line_layout in enumerate(document_layout.get_paragraph_layout(paragraph)['children']):
-                if content_offset_y + line_layout['y'] + document_layout.get_paragraph_layout(paragraph)['y'] + line_layout['height'] >= 0 and content_offset_y + line_layout['y'] + document_layout.get_paragraph_layout(paragraph)['y'] <= view_height:
-                    if (i,j) not in self.render_cache:
+                if content_offset_y + layout_y + line_layout['height'] >= 0 and content_offset_y + layout_y <= view_height:
+                    render_key = self.get_render_key(line_layout, in_selection)
+                    if (i,j) not in self.render_cache or self.render_cache[(i,j)][1] != render_key:
                         self.draw_line(ctx, i, j, line_layout, in_selection)
 
                     line_x = self.device_offset_x + math.floor(content_offset_x) * self.hidpi_factor
-                    line_y = self.device_offset_y + math.floor(content_offset_y + document_layout.get_paragraph_layout(paragraph)['y'] + line_layout['y']) * self.hidpi_factor
-                    ctx.set_source_surface(self.render_cache[(i,j)], line_x, line_y)
+                    line_y = self.device_offset_y + math.floor(content_offset_y + layout_y) * self.hidpi_factor
+                    ctx.set_source_surface(self.render_cache[(i,j)][0], line_x, line_y)
                     ctx.paint()
-                elif (i,j) in self.render_cache:
-                    del(self.render_cache[(i,j)])
+                    visible_lines.add((i,j))
 
-                if not in_selection and line_layout['y'] + line_layout['parent']['y'] == self.first_selection_line['y'] + self.first_selection_line['parent']['y']: in_selection = True
-                if in_selection and line_layout['y'] + line_layout['parent']['y'] == self.last_selection_line['y'] + self.last_selection_line['parent']['y']: in_selection = False
+        for key in [key for key in self.render_cache if key not in visible_lines]:
+            del(self.render_cache[key])
 
         if self.application.pointer.drop_cursor_x != -1 and self.application.pointer.drop_cursor_y != -1:
             self.draw_drop_cursor(ctx, content_offset_x, content_offset_y)
@@ -260,7 +285,15 @@ class DocumentView():
         self.draw_highlight_bg(layout, cairo.Context(surface), 0, -layout['y'])
         self.draw_selection_bg(layout, cairo.Context(surface), 0, -layout['y'], in_selection)
         self.draw_layout(layout, cairo.Context(surface), 0, -layout['y'])
-        self.render_cache[(paragraph_no, line_no)] = surface
+        self.render_cache[(paragraph_no, line_no)] = (surface, self.get_render_key(layout, in_selection))
+
+    # a line is drawn again if it was laid out anew, or if the part of it
+    # that is selected may have changed. The key holds the line layout itself,
+    # which is replaced whenever its paragraph changes.
+    def get_render_key(self, layout, in_selection):
+        first_selection_node = self.first_selection_node if layout is self.first_selection_line else None
+        last_selection_node = self.last_selection_node if layout is self.last_selection_line else None
+        return (id(layout), layout, in_selection, first_selection_node, last_selection_node)
 
     def draw_highlight_bg(self, layout, ctx, offset_x, offset_y):
         if layout['node'] != None and 'highlight' in layout['node'].tags:
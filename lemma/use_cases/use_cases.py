@@ -28,7 +28,7 @@ from lemma.services.settings import Settings
 from lemma.services.regex import RegexService
 from lemma.services.files import Files
 from lemma.services.node_type_db import NodeTypeDB
-from lemma.document.ast import Node
+from lemma.document.ast import Node, get_interned_tags
 from lemma.repos.workspace_repo import WorkspaceRepo
 from lemma.repos.document_repo import DocumentRepo
 from lemma.application_state.application_state import ApplicationState
@@ -69,6 +69,9 @@ class UseCases():
 
         elif link_target != None:
             target_list = DocumentRepo.list_by_title(link_target)
+            if len(target_list) == 0 and not DocumentRepo.has_all_stubs():
+                DocumentRepo.call_when_all_stubs_loaded(lambda: UseCases.open_link(link_target))
+                return
 
             if len(target_list) > 0:
                 document = DocumentRepo.get_by_id(target_list[0]['id'])
@@ -315,7 +318,7 @@ class UseCases():
         indentation_level = insert_paragraph.indentation_level
 
         node = Node('eol')
-        node.tags = tags.copy()
+        node.tags = get_interned_tags(tags)
         node.link = document.get_link_at_cursor()
         document.insert_nodes([node])
 
@@ -827,22 +830,19 @@ class UseCases():
             if new_node == None and box['type'] == 'vbox' or box['type'] == 'paragraph':
                 if box['type'] == 'vbox':
                     j = box['children'].index(ancestors[i - 1])
-                    prev_hboxes = box['children'][:j]
+                    prev_hboxes = reversed(box['children'][:j])
                 elif box['type'] == 'paragraph':
-                    prev_hboxes = []
-                    for paragraph in document.ast:
-                        for hbox in document_layout.get_paragraph_layout(paragraph)['children']:
-                            if hbox['y'] + hbox['parent']['y'] < ancestors[i - 1]['y'] + ancestors[i - 1]['parent']['y']:
-                                prev_hboxes.append(hbox)
-                for hbox in reversed(prev_hboxes):
-                    if new_node == None:
-                        min_distance = 10000
-                        for hbox_child in hbox['children']:
-                            layout_x, layout_y = document_layout.get_absolute_xy(hbox_child)
-                            distance = abs(layout_x - x)
-                            if distance < min_distance:
-                                new_node = hbox_child['node']
-                                min_distance = distance
+                    prev_hboxes = document_layout.get_lines_above(ancestors[i - 1])
+                for hbox in prev_hboxes:
+                    if new_node != None: break
+
+                    min_distance = 10000
+                    for hbox_child in hbox['children']:
+                        layout_x, layout_y = document_layout.get_absolute_xy(hbox_child)
+                        distance = abs(layout_x - x)
+                        if distance < min_distance:
+                            new_node = hbox_child['node']
+                            min_distance = distance
         if new_node == None:
             new_node = document.ast[0][0]
 
@@ -880,20 +880,17 @@ class UseCases():
                     j = box['children'].index(ancestors[i - 1])
                     prev_hboxes = box['children'][j + 1:]
                 elif box['type'] == 'paragraph':
-                    prev_hboxes = []
-                    for paragraph in document.ast:
-                        for hbox in document_layout.get_paragraph_layout(paragraph)['children']:
-                            if hbox['y'] + hbox['parent']['y'] > ancestors[i - 1]['y'] + ancestors[i - 1]['parent']['y']:
-                                prev_hboxes.append(hbox)
+                    prev_hboxes = document_layout.get_lines_below(ancestors[i - 1])
                 for child in prev_hboxes:
-                    if new_node == None:
-                        min_distance = 10000
-                        for child_layout in child['children']:
-                            layout_x, layout_y = document_layout.get_absolute_xy(child_layout)
-                            distance = abs(layout_x - x)
-                            if distance < min_distance:
-                                new_node = child_layout['node']
-                                min_distance = distance
+                    if new_node != None: break
+
+                    min_distance = 10000
+                    for child_layout in child['children']:
+                        layout_x, layout_y = document_layout.get_absolute_xy(child_layout)
+                        distance = abs(layout_x - x)
+                        if distance < min_distance:
+                            new_node = child_layout['node']
+                            min_distance = distance
         if new_node == None:
             new_node = document.ast[-1][-1]
 